@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+
+User = get_user_model()
+
+
+class TokenCache:
+    """LRU-кеш токенов в памяти процесса с ограниченным временем жизни.
+
+    Записи — кортежи (id пользователя, активен ли он, метка токенов),
+    их можно отдавать запросам без копирования.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_LOCAL_TTL
+)
+
+
+def shared_tokens():
+    """Общий для процессов кеш токенов и меток пользователей."""
+    return caches[settings.AUTH_TOKEN_CACHE]
+
+
+def shared_key(key):
+    # Сам токен в ключ не попадает: список ключей кеша не должен
+    # давать готовые учётные данные.
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def stamp_key(user_id):
+    return f'auth:user:{user_id}:stamp'
+
+
+def user_stamp(user_id):
+    """Метка токенов пользователя: меняется при выходе и правке профиля."""
+    return shared_tokens().get_or_set(
+        stamp_key(user_id), lambda: uuid.uuid4().hex, None
+    )
+
+
+def cached_token(key):
+    """Запись о токене, если её метка совпадает с меткой пользователя.
+
+    Копия в памяти процесса сверяется с общей меткой на каждом запросе,
+    так что выход и блокировка видны всем процессам сразу.
+    """
+    shared = shared_tokens()
+    entry = local_tokens.get(key)
+    if entry is None:
+        entry = shared.get(shared_key(key))
+        if entry is None:
+            return None
+    user_id, is_active, stamp = entry
+    if shared.get(stamp_key(user_id)) != stamp:
+        local_tokens.delete(key)
+        return None
+    local_tokens.set(key, entry)
+    return entry
+
+
+def remember_token(token):
+    entry = (
+        token.user_id, token.user.is_active, user_stamp(token.user_id)
+    )
+    local_tokens.set(token.key, entry)
+    shared_tokens().set(
+        shared_key(token.key), entry, settings.AUTH_TOKEN_CACHE_TTL
+    )
+
+
+def forget_user_tokens(user_id):
+    """Делает недействительными все записи о токенах пользователя.
+
+    Метка меняется после фиксации транзакции, иначе параллельный запрос
+    успеет запомнить токен под новой меткой.
+    """
+    transaction.on_commit(lambda: shared_tokens().set(
+        stamp_key(user_id), uuid.uuid4().hex, None
+    ))
+
+
+def forget_token(key, user_id):
+    def forget():
+        local_tokens.delete(key)
+        shared_tokens().delete(shared_key(key))
+    transaction.on_commit(forget)
+    forget_user_tokens(user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену без запроса к базе на каждый вызов API.
+
+    В кеше лежат только id пользователя и признак активности, а
+    пользователь собирается с отложенными полями: остальные поля
+    читаются из базы при первом обращении к ним. Изменяющие запросы
+    всегда проверяют токен по базе.
+    """
+
+    def authenticate(self, request):
+        self.refresh = request.method not in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        entry = None if self.refresh else cached_token(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            remember_token(token)
+            return user, token
+        user_id, is_active = entry[:2]
+        if not is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        user = User.from_db(
+            router.db_for_read(User), ('id', 'is_active'),
+            (user_id, is_active)
+        )
+        token = Token.from_db(
+            router.db_for_read(Token), ('key', 'user_id'), (key, user_id)
+        )
+        token.user = user
+        return user, token
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Favorite, ShoppingCart
+
+RECIPE_CATALOGUES = ('recipes', 'tags', 'ingredients')
+
+
+def new_version():
+    return {'token': uuid.uuid4().hex, 'modified': int(time.time())}
+
+
+def catalogue_version(name):
+    """Метка версии справочника: меняется при любом изменении данных."""
+    return cache.get_or_set(f'catalogue:{name}:version', new_version, None)
+
+
+def bump_catalogue_version(name):
+    cache.set(f'catalogue:{name}:version', new_version(), None)
+
+
+def bump_on_commit(name):
+    """Сбрасывает версию после фиксации транзакции.
+
+    Если сбросить раньше, параллельный запрос успеет положить в кеш ещё
+    не изменённые данные уже под новой версией.
+    """
+    transaction.on_commit(lambda: bump_catalogue_version(name))
+
+
+def catalogue_tokens(names):
+    keys = {f'catalogue:{name}:version': name for name in names}
+    found = cache.get_many(keys)
+    return [
+        (found.get(key) or catalogue_version(name))['token']
+        for key, name in keys.items()
+    ]
+
+
+def cached_catalogue(name, part, build):
+    """Производные данные справочника, например словарь slug → id.
+
+    Лежат в кеше под текущей версией справочника и пересчитываются
+    вызовом build только после её смены.
+    """
+    token = catalogue_version(name)['token']
+    return cache.get_or_set(
+        f'catalogue:{name}:{token}:{part}', build,
+        settings.CATALOGUE_CACHE_TIMEOUT
+    )
+
+
+def cached_catalogue_response(request, name, build):
+    """Отдаёт справочник готовыми байтами из кеша с ETag и Last-Modified.
+
+    build вызывается только при промахе и возвращает данные для
+    сериализации. Ключ включает версию справочника, поэтому после
+    изменения данных старые записи просто перестают читаться.
+    """
+    version = catalogue_version(name)
+    key = (
+        f'catalogue:{name}:{version["token"]}:'
+        f'{request.get_full_path()}'
+    )
+    entry = cache.get(key)
+    if entry is None:
+        body = JSONRenderer().render(build())
+        entry = {
+            'body': body,
+            'etag': f'"{hashlib.md5(body).hexdigest()}"',
+        }
+        cache.set(key, entry, settings.CATALOGUE_CACHE_TIMEOUT)
+    response = HttpResponse(entry['body'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(version['modified'])
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(
+        request,
+        etag=entry['etag'],
+        last_modified=version['modified'],
+        response=response
+    )
+
+
+def user_lists_changed(user_id):
+    bump_on_commit(f'user:{user_id}:lists')
+
+
+def user_lists(user_id):
+    """Id рецептов в избранном и в списке покупок пользователя."""
+    name = f'user:{user_id}:lists'
+    token = catalogue_version(name)['token']
+    return cache.get_or_set(f'catalogue:{name}:{token}', lambda: {
+        'favorites': set(Favorite.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+        'cart': set(ShoppingCart.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+    }, settings.CATALOGUE_CACHE_TIMEOUT)
+
+
+def recipes_response_key(request, extra=()):
+    """Ключ общего для всех пользователей ответа о рецептах.
+
+    Параметры запроса упорядочиваются, а версии рецептов, тегов,
+    ингредиентов и extra входят в ключ, так что после любой записи
+    старые ответы перестают читаться.
+    """
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    raw = json.dumps([
+        request.scheme, request.get_host(), request.path, params,
+        catalogue_tokens(RECIPE_CATALOGUES + tuple(extra)),
+    ])
+    return f'recipes:response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def with_user_lists(recipes, user):
+    """Подставляет в общий ответ is_favorited и is_in_shopping_cart."""
+    if not user.is_authenticated:
+        return recipes
+    lists = user_lists(user.pk)
+    return [
+        dict(
+            recipe,
+            is_favorited=recipe['id'] in lists['favorites'],
+            is_in_shopping_cart=recipe['id'] in lists['cart'],
+        )
+        for recipe in recipes
+    ]
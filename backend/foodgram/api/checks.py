@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def cache_is_shared(alias='default'):
+    """Видят ли записи кеша alias все процессы сервера."""
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def warn_process_local_cache(command):
+    """Предупреждает, что сервер не увидит метки, сброшенные командой."""
+    if not cache_is_shared():
+        command.stderr.write(command.style.WARNING(
+            'Кеш хранится в памяти процесса: запущенный сервер будет '
+            'отдавать прежние данные до перезапуска.'
+        ))
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(**kwargs):
+    # Метки версий справочников, списков пользователей и токенов, а также
+    # журнал индекса продуктов лежат в кеше. Их сбрасывают и другие
+    # процессы сервера, и команды manage.py: кеш в памяти одного процесса
+    # этих сбросов не увидит.
+    aliases = sorted({'default', settings.AUTH_TOKEN_CACHE})
+    return [
+        Error(
+            f'Кеш {alias!r} хранится в памяти процесса.',
+            hint=(
+                'Укажите общий для всех процессов кеш в CACHE_BACKEND и '
+                'CACHE_LOCATION.'
+            ),
+            id='api.E001',
+        )
+        for alias in aliases if not cache_is_shared(alias)
+    ]
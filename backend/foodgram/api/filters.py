@@ -1,18 +1,30 @@
 import django_filters
 from django.contrib.auth import get_user_model
-from rest_framework.filters import SearchFilter
+from django.db.models import Exists, F, FilteredRelation, OuterRef, Q
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Recipes
+from api.caching import cached_catalogue
+from api.search import search_recipes
+from api.services import schedule_leaderboard
+from recipes.models import RecipeRanking, Recipes, Tags
 
 User = get_user_model()
 
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+def tag_ids_by_slug():
+    return cached_catalogue(
+        'tags', 'slugs', lambda: dict(Tags.objects.values_list('slug', 'id'))
+    )
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids_by_slug()]
 
 
 class RecipeFilter(django_filters.FilterSet):
-    tags = django_filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = django_filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
+    )
     author = django_filters.ModelChoiceFilter(
         queryset=User.objects.all()
     )
@@ -20,3 +32,48 @@ class RecipeFilter(django_filters.FilterSet):
     class Meta:
         model = Recipes
         fields = ('tags', 'author',)
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов, без JOIN и DISTINCT."""
+        slugs = tag_ids_by_slug()
+        return queryset.filter(Exists(
+            Recipes.tags.through.objects.filter(
+                recipes_id=OuterRef('pk'),
+                tags_id__in=[slugs[slug] for slug in value if slug in slugs]
+            )
+        ))
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск по названию и описанию: ?search=."""
+
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_recipes(queryset, query)
+
+
+class RecipeRankingFilter(BaseFilterBackend):
+    """Сортировка по рейтингу: ?ordering=popular или ?ordering=trending.
+
+    Рецепты из рейтинга идут первыми по местам, остальные — после них
+    в обычном порядке, так что список не сокращается до размера
+    рейтинга. Остальные значения параметра игнорируются.
+    """
+
+    ordering_param = 'ordering'
+
+    def filter_queryset(self, request, queryset, view):
+        board = request.query_params.get(self.ordering_param)
+        if board not in dict(RecipeRanking.BOARDS):
+            return queryset
+        schedule_leaderboard(board)
+        return queryset.annotate(ranking=FilteredRelation(
+            'rankings', condition=Q(rankings__board=board)
+        )).order_by(
+            F('ranking__position').asc(nulls_last=True),
+            *Recipes._meta.ordering
+        )
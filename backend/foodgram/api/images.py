@@ -0,0 +1,193 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from api.caching import bump_catalogue_version
+from recipes.models import ImageBlob, Recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/variants'
+FORMATS = (
+    ('webp', 'WEBP', 'webp'),
+    ('jpeg', 'JPEG', 'jpg'),
+)
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def image_storage():
+    return Recipes._meta.get_field('image').storage
+
+
+def acquire_blob(name):
+    """Добавляет ссылку на файл изображения.
+
+    Строку обычно уже создало хранилище при сохранении файла.
+    """
+    blobs = ImageBlob.objects.filter(name=name)
+    if not blobs.update(references=F('references') + 1):
+        ImageBlob.objects.get_or_create(name=name)
+        blobs.update(references=F('references') + 1)
+
+
+def release_blob(name):
+    """Убирает ссылку на файл; файл без ссылок удаляется после фиксации."""
+    ImageBlob.objects.filter(name=name, references__gt=0).update(
+        references=F('references') - 1
+    )
+    transaction.on_commit(lambda: collect_blob(name))
+
+
+def collect_blob(name):
+    # Сохранение файла держит блокировку строки до фиксации ссылки на
+    # него, поэтому занятый файл здесь уже не окажется без ссылок.
+    with transaction.atomic():
+        deleted, _ = ImageBlob.objects.select_for_update().filter(
+            name=name, references=0
+        ).delete()
+        if deleted:
+            image_storage().delete(name)
+
+
+def variant_name(source, size, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'{VARIANTS_DIR}/{stem}/{size}.{extension}'
+
+
+def variant_files(variants):
+    return [
+        variant[key]
+        for variant in variants.get('sizes', {}).values()
+        for key, _, _ in FORMATS
+    ]
+
+
+def build_variants(source):
+    """Сохраняет уменьшенные копии изображения во всех форматах.
+
+    Изображение не увеличивается: если оно уже меньше размера варианта,
+    вариант только пережимается. Возвращает описание для
+    Recipes.image_variants.
+    """
+    with image_storage().open(source) as image_file:
+        original = ImageOps.exif_transpose(Image.open(image_file))
+        original.load()
+    if original.mode != 'RGB':
+        background = Image.new('RGB', original.size, 'white')
+        original = original.convert('RGBA')
+        background.paste(original, mask=original.getchannel('A'))
+        original = background
+    sizes = {}
+    for size, width in settings.IMAGE_VARIANTS:
+        image = original.copy()
+        image.thumbnail((width, original.height), Image.Resampling.LANCZOS)
+        variant = {'width': image.width, 'height': image.height}
+        for key, image_format, extension in FORMATS:
+            name = variant_name(source, size, extension)
+            buffer = io.BytesIO()
+            image.save(buffer, image_format,
+                       quality=settings.IMAGE_VARIANT_QUALITY)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            variant[key] = default_storage.save(
+                name, ContentFile(buffer.getvalue())
+            )
+        sizes[size] = variant
+    return {'source': source, 'sizes': sizes}
+
+
+def delete_variants(variants):
+    for name in variant_files(variants):
+        default_storage.delete(name)
+
+
+def process_image(source, rebuild=False):
+    """Строит варианты изображения для всех рецептов, где оно стоит.
+
+    Если у другого рецепта с тем же файлом варианты уже есть, они
+    переиспользуются, пока не передан rebuild. Запись идёт только в
+    рецепты, у которых изображение всё ещё source: если его успели
+    заменить, новые варианты строит следующая задача. Прежние варианты
+    удаляются, когда ими больше никто не пользуется.
+    """
+    recipes = Recipes.objects.filter(image=source)
+    previous, variants = {}, None
+    for current in recipes.values_list('image_variants', flat=True):
+        if current.get('source') == source:
+            variants = current
+        elif current.get('source') is not None:
+            previous[current['source']] = current
+    if variants is None or rebuild:
+        variants = build_variants(source)
+    if not recipes.update(image_variants=variants):
+        release_variants(variants)
+        return
+    bump_catalogue_version('recipes')
+    for old in previous.values():
+        release_variants(old)
+
+
+def release_variants(variants):
+    source = variants.get('source')
+    if source and not Recipes.objects.filter(image=source).exists():
+        delete_variants(variants)
+
+
+def run(source):
+    try:
+        process_image(source)
+    except Exception:
+        logger.exception('Не удалось построить варианты %s', source)
+
+
+def work(source):
+    try:
+        run(source)
+    finally:
+        close_old_connections()
+
+
+def image_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+        return executor
+
+
+def wait_for_images():
+    """Дожидается задач пула и останавливает его."""
+    global executor
+    with executor_lock:
+        if executor is not None:
+            executor.shutdown(wait=True)
+            executor = None
+
+
+def schedule_variants(source):
+    """Ставит построение вариантов в пул после фиксации транзакции.
+
+    Pillow отпускает GIL при масштабировании и кодировании, поэтому
+    потоки пула работают параллельно с обработкой запросов. При
+    IMAGE_WORKERS = 0 варианты строятся сразу в текущем потоке.
+    """
+    def submit():
+        if settings.IMAGE_WORKERS:
+            image_executor().submit(work, source)
+        else:
+            run(source)
+    transaction.on_commit(submit)
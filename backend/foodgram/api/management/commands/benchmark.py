@@ -0,0 +1,442 @@
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.images import wait_for_images
+from api.paginators import CustomPagination
+from api.search import pantry_index
+from api.services import rebuild_shopping_lists, rebuild_timelines
+from recipes.management.commands.generate_fixtures import letters
+from recipes.models import Favorite, Ingredient, Recipes, ShoppingCart, Tags
+from users.models import Follow
+
+User = get_user_model()
+
+BATCH_SIZE = 20
+
+
+def image_base64():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), '#E26C2D').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет тестовую базу синтетическими данными, прогоняет все '
+        'эндпоинты API и сравнивает количество запросов к БД и размер '
+        'ответа с сохранённым эталоном. Время ответа зависит от машины и '
+        'сравнивается только с --compare-time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--baseline',
+            default=os.path.join(
+                settings.BASE_DIR, 'data', 'benchmark_baseline.json'
+            ),
+            help='Файл с эталонными результатами.'
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Записать текущие результаты как новый эталон.'
+        )
+        parser.add_argument(
+            '--size-tolerance', type=float, default=0.1,
+            help='Допустимый относительный рост размера ответа.'
+        )
+        parser.add_argument(
+            '--compare-time', action='store_true',
+            help='Сравнивать и время ответа; имеет смысл, только если '
+                 'эталон снят на этой же машине.'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Допустимый относительный рост времени ответа.'
+        )
+        parser.add_argument(
+            '--slack-ms', type=float, default=5.0,
+            help='Абсолютный запас по времени ответа в миллисекундах.'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                try:
+                    self.seed(options)
+                    results = self.run_scenarios(options['repeat'])
+                finally:
+                    wait_for_images()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        dataset = {
+            'users': options['users'],
+            'recipes': options['recipes'],
+            'seed': options['seed'],
+        }
+        if options['save_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump({'dataset': dataset, 'results': results}, file,
+                          ensure_ascii=False, indent=2, sort_keys=True)
+            self.report(results, {})
+            self.stdout.write(self.style.SUCCESS(
+                f'Эталон сохранён в {options["baseline"]}'
+            ))
+            return
+
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            self.report(results, {})
+            self.stdout.write(self.style.WARNING(
+                'Эталон не найден, сравнение пропущено.'
+            ))
+            return
+        regressions = self.compare(
+            results, baseline['results'], options,
+            same_dataset=baseline['dataset'] == dataset
+        )
+        self.report(results, regressions)
+        if regressions:
+            raise CommandError(
+                'Превышен эталон: ' + ', '.join(sorted(regressions))
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий не обнаружено.'))
+
+    def seed(self, options):
+        call_command('generate_fixtures', users=options['users'],
+                     recipes=options['recipes'], seed=options['seed'],
+                     stdout=self.stdout)
+        call_command('build_similarity', full=True, stdout=self.stdout)
+
+    def run_scenarios(self, repeat):
+        user = User.objects.create_user(
+            email='benchmark@foodgram.ru', username='benchmark',
+            first_name='Бенчмарк', last_name='Бенчмарк', password='benchmark'
+        )
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}'
+        )
+        anonymous = APIClient()
+        reader = APIClient()
+        reader.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(
+            user=User.objects.exclude(pk=user.pk).first()
+        ).key)
+
+        recipe_ids = list(Recipes.objects.values_list('id', flat=True))
+        author_ids = list(User.objects.exclude(pk=user.pk).values_list(
+            'id', flat=True
+        ))
+        tag_ids = list(Tags.objects.values_list('id', flat=True))
+        tag_slugs = list(Tags.objects.values_list('slug', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        cart = random.sample(recipe_ids, 30)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe_id=recipe_id) for recipe_id in cart
+        )
+        rebuild_shopping_lists([user.pk])
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe_id=recipe_id)
+            for recipe_id in random.sample(recipe_ids, 30)
+        )
+        follows = random.sample(author_ids, 100)
+        Follow.objects.bulk_create(
+            Follow(user=user, author_id=author_id) for author_id in follows
+        )
+        call_command('recount', stdout=self.stdout)
+        rebuild_timelines()
+        free_recipes = random.sample(
+            list(set(recipe_ids) - set(cart) - set(
+                Favorite.objects.filter(user=user).values_list(
+                    'recipe_id', flat=True
+                )
+            )), repeat * (BATCH_SIZE + 1)
+        )
+        free_authors = random.sample(
+            list(set(author_ids) - set(follows)), repeat * (BATCH_SIZE + 1)
+        )
+        recipe_batches = [
+            free_recipes[repeat + i * BATCH_SIZE:repeat + (i + 1) * BATCH_SIZE]
+            for i in range(repeat)
+        ]
+        author_batches = [
+            free_authors[repeat + i * BATCH_SIZE:repeat + (i + 1) * BATCH_SIZE]
+            for i in range(repeat)
+        ]
+        detail_id = random.choice(recipe_ids)
+        search_word = Recipes.objects.get(pk=detail_id).name.split()[-1]
+        deep_page = max(1, len(recipe_ids) // 6)
+        deep_cursor = CustomPagination().encode_cursor(
+            Recipes.objects.all()[(deep_page - 1) * 6]
+        )
+        image = image_base64()
+
+        def payload(number):
+            return {
+                'name': f'Бенчмарк {letters(number)}',
+                'text': 'Описание рецепта',
+                'cooking_time': 30,
+                'image': image,
+                'tags': random.sample(tag_ids, 2),
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': random.randint(1, 500)}
+                    for ingredient_id in random.sample(ingredient_ids, 10)
+                ],
+            }
+
+        own_recipe = client.post(
+            '/api/recipes/', payload(repeat * 2), format='json'
+        ).json()['id']
+        pantry = '&'.join(
+            f'ingredients={ingredient_id}'
+            for ingredient_id in random.sample(ingredient_ids, 8)
+        )
+        pantry_index.search(())
+        call_command('refresh_leaderboards', stdout=self.stdout)
+
+        scenarios = (
+            ('recipes_list_anonymous',
+             lambda i: anonymous.get('/api/recipes/?page=1&limit=6')),
+            ('recipes_list',
+             lambda i: client.get('/api/recipes/?page=1&limit=6')),
+            ('recipes_list_cached',
+             lambda i: client.get('/api/recipes/?limit=6&page=1')),
+            ('recipes_list_deep_page',
+             lambda i: client.get(f'/api/recipes/?page={deep_page}&limit=6')),
+            ('recipes_list_cursor',
+             lambda i: client.get('/api/recipes/?cursor=&limit=6')),
+            ('recipes_list_cursor_deep_page',
+             lambda i: client.get(
+                 f'/api/recipes/?cursor={deep_cursor}&limit=6'
+             )),
+            ('recipes_list_tags',
+             lambda i: client.get(
+                 f'/api/recipes/?limit=6&tags={tag_slugs[0]}'
+                 f'&tags={tag_slugs[1]}'
+             )),
+            ('recipes_search',
+             lambda i: client.get(
+                 f'/api/recipes/?limit=6&search={search_word}'
+             )),
+            ('recipes_search_common',
+             lambda i: client.get('/api/recipes/?limit=6&search=рецепт')),
+            ('recipes_cook',
+             lambda i: client.get(f'/api/recipes/cook/?limit=6&{pantry}')),
+            ('recipes_cook_max_missing',
+             lambda i: client.get(
+                 f'/api/recipes/cook/?limit=6&max_missing=2&{pantry}'
+             )),
+            ('recipes_list_popular',
+             lambda i: client.get('/api/recipes/?limit=6&ordering=popular')),
+            ('recipes_list_trending',
+             lambda i: client.get('/api/recipes/?limit=6&ordering=trending')),
+            ('recipes_top',
+             lambda i: anonymous.get('/api/recipes/top/?limit=10')),
+            ('recipes_feed',
+             lambda i: client.get('/api/recipes/feed/?limit=6')),
+            ('recipes_feed_cursor',
+             lambda i: client.get('/api/recipes/feed/?limit=6&cursor=')),
+            ('recipes_feed_join',
+             lambda i: reader.get('/api/recipes/feed/?limit=6')),
+            ('recipes_list_favorited',
+             lambda i: client.get('/api/recipes/?limit=6&is_favorited=1')),
+            ('recipes_list_in_shopping_cart',
+             lambda i: client.get(
+                 '/api/recipes/?limit=6&is_in_shopping_cart=1'
+             )),
+            ('recipes_detail',
+             lambda i: client.get(f'/api/recipes/{detail_id}/')),
+            ('recipes_detail_cached',
+             lambda i: client.get(f'/api/recipes/{detail_id}/')),
+            ('recipes_similar',
+             lambda i: client.get(f'/api/recipes/{detail_id}/similar/')),
+            ('recipes_create',
+             lambda i: client.post(
+                 '/api/recipes/', payload(i), format='json'
+             )),
+            ('recipes_update',
+             lambda i: client.patch(
+                 f'/api/recipes/{own_recipe}/', payload(repeat + i),
+                 format='json'
+             )),
+            ('favorite_add',
+             lambda i: client.post(
+                 f'/api/recipes/{free_recipes[i]}/favorite/'
+             )),
+            ('favorite_delete',
+             lambda i: client.delete(
+                 f'/api/recipes/{free_recipes[i]}/favorite/'
+             )),
+            ('shopping_cart_add',
+             lambda i: client.post(
+                 f'/api/recipes/{free_recipes[i]}/shopping_cart/'
+             )),
+            ('shopping_cart_delete',
+             lambda i: client.delete(
+                 f'/api/recipes/{free_recipes[i]}/shopping_cart/'
+             )),
+            ('shopping_list',
+             lambda i: client.get('/api/recipes/shopping_list/')),
+            ('favorite_batch_add',
+             lambda i: client.post(
+                 '/api/recipes/favorite/', {'ids': recipe_batches[i]},
+                 format='json'
+             )),
+            ('favorite_batch_delete',
+             lambda i: client.delete(
+                 '/api/recipes/favorite/', {'ids': recipe_batches[i]},
+                 format='json'
+             )),
+            ('shopping_cart_batch_add',
+             lambda i: client.post(
+                 '/api/recipes/shopping_cart/', {'ids': recipe_batches[i]},
+                 format='json'
+             )),
+            ('shopping_cart_batch_delete',
+             lambda i: client.delete(
+                 '/api/recipes/shopping_cart/', {'ids': recipe_batches[i]},
+                 format='json'
+             )),
+            ('download_shopping_cart',
+             lambda i: client.get('/api/recipes/download_shopping_cart/')),
+            ('download_shopping_cart_csv',
+             lambda i: client.get(
+                 '/api/recipes/download_shopping_cart/?format=csv'
+             )),
+            ('download_shopping_cart_pdf',
+             lambda i: client.get(
+                 '/api/recipes/download_shopping_cart/?format=pdf'
+             )),
+            ('tags_list', lambda i: client.get('/api/tags/')),
+            ('ingredients_search',
+             lambda i: client.get('/api/ingredients/?name=мо')),
+            ('subscriptions',
+             lambda i: client.get(
+                 '/api/users/subscriptions/?limit=6&recipes_limit=3'
+             )),
+            ('subscriptions_large_page',
+             lambda i: client.get(
+                 '/api/users/subscriptions/?limit=100&recipes_limit=3'
+             )),
+            ('subscribe',
+             lambda i: client.post(
+                 f'/api/users/{free_authors[i]}/subscribe/'
+             )),
+            ('unsubscribe',
+             lambda i: client.delete(
+                 f'/api/users/{free_authors[i]}/subscribe/'
+             )),
+            ('subscribe_batch',
+             lambda i: client.post(
+                 '/api/users/subscribe/', {'ids': author_batches[i]},
+                 format='json'
+             )),
+            ('unsubscribe_batch',
+             lambda i: client.delete(
+                 '/api/users/subscribe/', {'ids': author_batches[i]},
+                 format='json'
+             )),
+        )
+        return {
+            name: self.measure(name, request, repeat)
+            for name, request in scenarios
+        }
+
+    def measure(self, name, request, repeat):
+        timings = []
+        queries = size = 0
+        for number in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = request(number)
+                if getattr(response, 'streaming', False):
+                    content = b''.join(response.streaming_content)
+                else:
+                    content = response.content
+                timings.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{name}: ответ {response.status_code} {content[:200]}'
+                )
+            queries = max(queries, len(context))
+            size = max(size, len(content))
+        return {
+            'queries': queries,
+            'time_ms': round(statistics.median(timings) * 1000, 2),
+            'size': size,
+        }
+
+    def compare(self, results, baseline, options, same_dataset):
+        """Сценарии, превысившие эталон.
+
+        Размер и время ответа зависят от данных, поэтому сравниваются
+        только на том же наборе, что и эталон.
+        """
+        regressions = set()
+        for name, expected in baseline.items():
+            actual = results.get(name)
+            if actual is None:
+                continue
+            if actual['queries'] > expected['queries']:
+                regressions.add(name)
+            if not same_dataset:
+                continue
+            if actual['size'] > expected['size'] * (
+                1 + options['size_tolerance']
+            ):
+                regressions.add(name)
+            if options['compare_time'] and (
+                actual['time_ms'] > expected['time_ms'] * (
+                    1 + options['tolerance']
+                ) + options['slack_ms']
+            ):
+                regressions.add(name)
+        return regressions
+
+    def report(self, results, regressions):
+        self.stdout.write(
+            f'{"эндпоинт":<32}{"запросов":>10}{"мс":>10}{"байт":>10}'
+        )
+        for name, result in results.items():
+            line = (
+                f'{name:<32}{result["queries"]:>10}'
+                f'{result["time_ms"]:>10}{result["size"]:>10}'
+            )
+            if name in regressions:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
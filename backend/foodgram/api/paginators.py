@@ -1,6 +1,136 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
 
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (LimitOffsetPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-class CustomPagination(PageNumberPagination):
+
+class KeysetPaginationMixin:
+    """Необязательный курсорный режим пагинации по ключу сортировки.
+
+    Включается параметром cursor (пустое значение — первая страница).
+    Следующая страница выбирается условием по последнему ключу вместо
+    OFFSET, а общее количество записей не считается.
+    """
+    cursor_query_param = 'cursor'
+    keyset_ordering = ()
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        if queryset.query.order_by:
+            # Страницы курсора идут по keyset_ordering: другая сортировка,
+            # например рейтинг или релевантность поиска, была бы потеряна.
+            raise serializers.ValidationError({self.cursor_query_param: [
+                'Курсор нельзя сочетать с сортировкой и поиском'
+            ]})
+        self.request = request
+        page_size = self.get_keyset_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(
+                self.after(queryset.model, self.decode_cursor(cursor))
+            )
+        page = list(queryset.order_by(*self.keyset_ordering)[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_keyset_page_size(self, request):
+        return self.get_page_size(request)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_keyset_next_link()),
+            ('results', data),
+        ]))
+
+    def get_keyset_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor
+        )
+
+    def fields(self):
+        return [field.lstrip('-') for field in self.keyset_ordering]
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.fields():
+            value = getattr(instance, field)
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value
+            )
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(
+            self.keyset_ordering
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def after(self, model, values):
+        """Условие «строго после курсора» для составного ключа."""
+        condition = Q()
+        equal = {}
+        for ordering, value in zip(self.keyset_ordering, values):
+            name = ordering.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                # В подделанном курсоре вместо строки может оказаться
+                # число или список: поля на них падают с TypeError.
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+
+class CustomPagination(KeysetPaginationMixin, PageNumberPagination):
+    page_size_query_param = 'limit'
+    page_size = 6
+    keyset_ordering = ('-pub_date', '-id')
+
+
+class TimelinePagination(CustomPagination):
+    """Пагинация записей FeedEntry: курсор совместим с CustomPagination."""
+    keyset_ordering = ('-pub_date', '-recipe_id')
+
+
+class SubscriptionsPagination(KeysetPaginationMixin, LimitOffsetPagination):
+    keyset_ordering = ('id',)
+
+    def get_keyset_page_size(self, request):
+        return self.get_limit(request)
+
+
+class RankedPagination(PageNumberPagination):
+    """Постраничный вывод уже отсортированного списка, без курсора."""
     page_size_query_param = 'limit'
     page_size = 6
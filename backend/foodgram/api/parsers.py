@@ -0,0 +1,111 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+from django.http.multipartparser import MultiPartParser as DjangoParser
+from django.http.multipartparser import MultiPartParserError
+from django.template.defaultfilters import filesizeformat
+from PIL import ImageFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+# Сколько первых байт файла читать, чтобы узнать размеры изображения:
+# перед ними в JPEG может идти блок EXIF.
+IMAGE_HEADER_LIMIT = 256 * 1024
+
+
+class UploadRejected(MultiPartParserError):
+    pass
+
+
+def check_upload_size(size):
+    limit = settings.IMAGE_UPLOAD_MAX_SIZE
+    if size > limit:
+        raise UploadRejected(f'Изображение больше {filesizeformat(limit)}')
+
+
+def check_image_size(width, height):
+    limit = settings.IMAGE_UPLOAD_MAX_DIMENSION
+    if max(width, height) > limit:
+        raise UploadRejected(
+            f'Изображение {width}×{height} больше {limit} точек по стороне'
+        )
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет изображение на диск и проверяет его по ходу загрузки.
+
+    Размер файла и размеры изображения проверяются по мере поступления
+    данных, так что слишком большой файл отклоняется, не дочитываясь.
+    Остальные файлы запроса пропускаются.
+    """
+    field_name = 'image'
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != self.field_name:
+            raise SkipFile()
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+        self.header = ImageFile.Parser()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        check_upload_size(self.received)
+        if self.header is not None:
+            self.read_header(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def read_header(self, raw_data):
+        self.header.feed(raw_data)
+        image = self.header.image
+        if image is not None:
+            self.header = None
+            check_image_size(*image.size)
+        elif self.received > IMAGE_HEADER_LIMIT:
+            # Не изображение: это отклонит проверка поля.
+            self.header = None
+
+
+def form_list(values):
+    """Список из формы: JSON-массив в одном поле или повтор поля."""
+    if len(values) == 1:
+        try:
+            value = json.loads(values[0])
+        except ValueError:
+            return values
+        if isinstance(value, list):
+            return value
+    return values
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    """multipart/form-data для создания и изменения рецепта.
+
+    Изображение не кодируется в base64 и не держится в памяти: оно
+    пишется во временный файл через ImageUploadHandler. Теги и
+    ингредиенты передаются JSON-строкой, теги можно и повтором поля.
+    """
+    list_fields = ('tags', 'ingredients')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        handler = ImageUploadHandler(request)
+        parser = DjangoParser(
+            meta, stream, [handler],
+            parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        )
+        try:
+            data, files = parser.parse()
+        except UploadRejected as error:
+            handler.file.close()
+            raise ParseError({'image': [str(error)]})
+        except MultiPartParserError as error:
+            raise ParseError(f'Multipart form parse error - {error}')
+        return DataAndFiles({
+            key: form_list(values) if key in self.list_fields else values[-1]
+            for key, values in data.lists()
+        }, files.dict())
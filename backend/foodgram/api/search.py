@@ -0,0 +1,341 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from api.caching import bump_catalogue_version, catalogue_version
+from recipes.models import Ingredient, RecipeIngredient, Recipes
+
+CHUNK_SIZE = 2000
+WORD_RE = re.compile(r'\w+')
+CHANGES_KEY = 'catalogue:recipe_ingredients:changes'
+# Таблица FTS5 из миграции recipes 0005, только для SQLite.
+SEARCH_TABLE = 'recipes_search'
+# Если процесс отстал на большее число изменений, дешевле собрать
+# индекс заново, чем догонять журнал.
+MAX_CHANGES = 1000
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    метка версии в кеше. Метку сбрасывают сигналы сохранения и удаления
+    ингредиентов; чтобы её видели все процессы, кеш должен быть общим.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._names = []
+        self._rows = []
+
+    def _load(self):
+        version = catalogue_version('ingredients')['token']
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    rows = sorted(
+                        Ingredient.objects.values(
+                            'id', 'name', 'measurement_unit'
+                        ),
+                        key=lambda row: (row['name'].lower(), row['id'])
+                    )
+                    self._names = [row['name'].lower() for row in rows]
+                    self._rows = rows
+                    self._version = version
+        return self._names, self._rows
+
+    def all(self):
+        return self._load()[1]
+
+    def search(self, query, limit=None):
+        """Сначала ингредиенты, начинающиеся с query, затем содержащие его."""
+        names, rows = self._load()
+        query = query.lower()
+        found = []
+        start = bisect_left(names, query)
+        for position in range(start, len(names)):
+            if limit is not None and len(found) >= limit:
+                return [rows[position] for position in found]
+            if not names[position].startswith(query):
+                break
+            found.append(position)
+        prefix_end = start + len(found)
+        for position, name in enumerate(names):
+            if limit is not None and len(found) >= limit:
+                break
+            if start <= position < prefix_end:
+                continue
+            if query in name:
+                found.append(position)
+        return [rows[position] for position in found]
+
+
+ingredient_index = IngredientIndex()
+
+
+class PantryIndex:
+    """Обратный индекс «ингредиент → рецепты» для подбора по продуктам.
+
+    Для каждого ингредиента хранится список рецептов, где он встречается,
+    а для рецепта — его ингредиенты и время приготовления. Поиск
+    складывает списки нужных ингредиентов и не обращается к базе.
+
+    Целиком индекс собирается при первом обращении и после смены метки
+    версии 'recipe_ingredients'. Сохранённые и удалённые рецепты сигналы
+    записывают в журнал в кеше, и процесс перечитывает из базы только
+    их. Если журнал потерян или процесс слишком отстал, индекс
+    собирается заново.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._sequence = 0
+        self._postings = {}
+        self._ingredients = {}
+        self._cooking_times = {}
+
+    def _current(self):
+        return (
+            catalogue_version('recipe_ingredients')['token'],
+            cache.get(CHANGES_KEY, 0),
+        )
+
+    def _load(self):
+        if self._current() != (self._version, self._sequence):
+            with self._lock:
+                # Номер читается до сборки: изменения, записанные во время
+                # неё, применятся ещё раз при следующем обращении.
+                version, sequence = self._current()
+                if version != self._version or not self._apply(sequence):
+                    self._build()
+                    self._version = version
+                self._sequence = sequence
+        return self._postings, self._ingredients, self._cooking_times
+
+    def _build(self):
+        postings = defaultdict(lambda: array('I'))
+        ingredients = defaultdict(list)
+        rows = RecipeIngredient.objects.order_by().values_list(
+            'ingredient_id', 'recipe_id'
+        ).iterator(chunk_size=CHUNK_SIZE)
+        for ingredient_id, recipe_id in rows:
+            postings[ingredient_id].append(recipe_id)
+            ingredients[recipe_id].append(ingredient_id)
+        self._postings = dict(postings)
+        self._ingredients = {
+            recipe_id: tuple(ids) for recipe_id, ids in ingredients.items()
+        }
+        self._cooking_times = dict(
+            Recipes.objects.order_by().values_list('id', 'cooking_time')
+        )
+
+    def _changes(self, sequence):
+        """Id рецептов из журнала после self._sequence до sequence.
+
+        None, если журнал не покрывает разрыв.
+        """
+        if not 0 <= sequence - self._sequence <= MAX_CHANGES:
+            return None
+        keys = [
+            f'{CHANGES_KEY}:{number}'
+            for number in range(self._sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return None
+        return set(changes.values())
+
+    def _apply(self, sequence):
+        """Переносит в индекс рецепты из журнала; False — нужна сборка."""
+        recipe_ids = self._changes(sequence)
+        if recipe_ids is None:
+            return False
+        if not recipe_ids:
+            return True
+        current = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by().values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].append(ingredient_id)
+        cooking_times = dict(Recipes.objects.filter(
+            pk__in=recipe_ids
+        ).order_by().values_list('id', 'cooking_time'))
+        removed, added = defaultdict(set), defaultdict(list)
+        for recipe_id in recipe_ids:
+            old = set(self._ingredients.get(recipe_id, ()))
+            new = set(current[recipe_id])
+            for ingredient_id in old - new:
+                removed[ingredient_id].add(recipe_id)
+            for ingredient_id in new - old:
+                added[ingredient_id].append(recipe_id)
+            self._ingredients.pop(recipe_id, None)
+            if new:
+                self._ingredients[recipe_id] = tuple(current[recipe_id])
+            self._cooking_times.pop(recipe_id, None)
+            if recipe_id in cooking_times:
+                self._cooking_times[recipe_id] = cooking_times[recipe_id]
+        self._update_postings(removed, added)
+        return True
+
+    def _update_postings(self, removed, added):
+        # Списки не меняются на месте, а заменяются новыми: поиск в
+        # других потоках читает их без блокировки.
+        for ingredient_id in set(removed) | set(added):
+            gone = removed[ingredient_id]
+            posting = array('I', (
+                recipe_id
+                for recipe_id in self._postings.get(ingredient_id, ())
+                if recipe_id not in gone
+            ))
+            posting.extend(added[ingredient_id])
+            if posting:
+                self._postings[ingredient_id] = posting
+            else:
+                self._postings.pop(ingredient_id, None)
+
+    def search(self, ingredient_ids, max_missing=None, cooking_time=None):
+        """Рецепты, где есть хотя бы один из ингредиентов.
+
+        Возвращает тройки (id рецепта, найдено ингредиентов, всего
+        ингредиентов), отсортированные по доле найденных, затем по числу
+        недостающих и от новых рецептов к старым.
+        """
+        postings, ingredients, cooking_times = self._load()
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        found = []
+        for recipe_id, count in matched.items():
+            # Рецепт мог быть удалён из индекса, пока шёл поиск.
+            total = len(ingredients.get(recipe_id, ()))
+            if not total:
+                continue
+            if max_missing is not None and total - count > max_missing:
+                continue
+            if (cooking_time is not None
+                    and cooking_times.get(recipe_id, 0) > cooking_time):
+                continue
+            found.append((recipe_id, count, total))
+        found.sort(key=lambda row: (
+            -row[1] / row[2], row[2] - row[1], -row[0]
+        ))
+        return found
+
+
+pantry_index = PantryIndex()
+
+
+def recipe_ingredients_changed(recipe_id):
+    """Записывает рецепт в журнал изменений индекса после фиксации."""
+    def log():
+        if cache.add(CHANGES_KEY, 0, None):
+            # Счётчик журнала вытеснен и начат заново: номера повторятся,
+            # поэтому процессы должны собрать индекс по новой версии.
+            bump_catalogue_version('recipe_ingredients')
+        sequence = cache.incr(CHANGES_KEY)
+        cache.set(
+            f'{CHANGES_KEY}:{sequence}', recipe_id,
+            settings.CATALOGUE_CACHE_TIMEOUT
+        )
+    transaction.on_commit(log)
+
+
+def search_words(query):
+    return WORD_RE.findall(query.lower())
+
+
+def search_recipes(queryset, query):
+    """Оставляет рецепты, подходящие под запрос, и сортирует по релевантности.
+
+    Каждое слово запроса ищется как начало слова. Совпадение в названии
+    весит больше, чем в описании. Ранг кладётся в аннотацию search_rank:
+    чем меньше значение, тем выше рецепт в выдаче.
+    """
+    words = search_words(query)
+    if not words:
+        return queryset.none()
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    recipes = quote(Recipes._meta.db_table)
+    recipe_id = f'{recipes}.{quote(Recipes._meta.pk.column)}'
+    if connection.vendor == 'postgresql':
+        vector = f'{recipes}.search_vector'
+        tsquery = "to_tsquery('russian', %s)"
+        params = (' & '.join(f'{word}:*' for word in words),)
+        rank = f'-ts_rank({vector}, {tsquery})'
+        found = f'{vector} @@ {tsquery}'
+    elif connection.vendor == 'sqlite':
+        # bm25 считается только в запросе с MATCH, поэтому ранг берётся
+        # подзапросом: по rowid FTS5 находит строку без перебора.
+        table = quote(SEARCH_TABLE)
+        params = (' '.join(f'"{word}"*' for word in words),)
+        rank = (
+            f'(SELECT bm25({table}, 10.0, 1.0) FROM {table} '
+            f'WHERE {table} MATCH %s AND rowid = {recipe_id})'
+        )
+        found = (
+            f'{recipe_id} IN (SELECT rowid FROM {table} '
+            f'WHERE {table} MATCH %s)'
+        )
+    else:
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word) | Q(text__icontains=word)
+        return queryset.filter(condition)
+    return queryset.annotate(
+        search_rank=RawSQL(rank, params, output_field=FloatField())
+    ).filter(
+        RawSQL(found, params, output_field=BooleanField())
+    ).order_by('search_rank', *Recipes._meta.ordering)
+
+
+def index_connection(using):
+    return connections[using or router.db_for_write(Recipes)]
+
+
+def index_recipe(recipe):
+    """Обновляет запись рецепта в таблице FTS5.
+
+    В Postgres индекс строится самой базой по вычисляемой колонке.
+    """
+    connection = index_connection(recipe._state.db)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, name, text) '
+            'VALUES (%s, %s, %s)', (recipe.pk, recipe.name, recipe.text)
+        )
+
+
+def unindex_recipe(recipe):
+    connection = index_connection(recipe._state.db)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', (recipe.pk,)
+        )
+
+
+def rebuild_recipe_index(using=None):
+    """Заполняет таблицу FTS5 заново, например после bulk_create."""
+    connection = index_connection(using)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE}(rowid, name, text) '
+            f'SELECT id, name, text FROM {Recipes._meta.db_table}'
+        )
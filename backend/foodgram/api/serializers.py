@@ -1,16 +1,30 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from api.parsers import (UploadRejected, check_image_size,
+                         check_upload_size)
+from api.services import publish_to_timelines, update_shopping_lists
 from recipes.models import (Favorite, Ingredient, RecipeIngredient, Recipes,
-                            ShoppingCart, Tags)
+                            ShoppingCart, ShoppingList, Tags)
 
 User = get_user_model()
 
 
+def ingredients_prefetch():
+    return Prefetch(
+        'ingredients_amount',
+        queryset=RecipeIngredient.objects.select_related('ingredient')
+    )
+
+
 class TagsSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -40,18 +54,57 @@ class RecipeIngredientWriteSerializer(serializers.Serializer):
 
 class RecipeIngredientReadSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source='ingredient_id')
-    name = serializers.SerializerMethodField(read_only=True)
-    measurement_unit = serializers.SerializerMethodField(read_only=True)
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
 
     class Meta:
         fields = ('id', 'name', 'amount', 'measurement_unit')
         model = RecipeIngredient
 
-    def get_name(self, obj):
-        return obj.ingredient.name
 
-    def get_measurement_unit(self, obj):
-        return obj.ingredient.measurement_unit
+class ShoppingListSerializer(serializers.ModelSerializer):
+    id = serializers.ReadOnlyField(source='ingredient_id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+        model = ShoppingList
+
+
+class ImageSrcsetField(serializers.Field):
+    """Уменьшенные копии изображения рецепта: размер → ширина и url.
+
+    Пока копии нового изображения не построены, отдаётся пустой словарь,
+    и клиент показывает исходное изображение.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variants = recipe.image_variants
+        if variants.get('source') != recipe.image.name:
+            return {}
+        request = self.context.get('request')
+        srcset = {}
+        for size, variant in variants['sizes'].items():
+            srcset[size] = {
+                'width': variant['width'],
+                'height': variant['height'],
+            }
+            for key in ('webp', 'jpeg'):
+                url = default_storage.url(variant[key])
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                srcset[size][key] = url
+        return srcset
 
 
 class RecipesReadSerializer(serializers.ModelSerializer):
@@ -61,6 +114,7 @@ class RecipesReadSerializer(serializers.ModelSerializer):
     author = UserSerializer()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipes
@@ -69,6 +123,7 @@ class RecipesReadSerializer(serializers.ModelSerializer):
             'author',
             'name',
             'image',
+            'srcset',
             'text',
             'id',
             'ingredients',
@@ -88,12 +143,16 @@ class RecipesReadSerializer(serializers.ModelSerializer):
         ).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
         return Favorite.objects.filter(recipe=obj, user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
@@ -101,6 +160,50 @@ class RecipesReadSerializer(serializers.ModelSerializer):
                                            user=request.user).exists()
 
 
+class PantryRecipeSerializer(RecipesReadSerializer):
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipesReadSerializer.Meta):
+        fields = RecipesReadSerializer.Meta.fields + ('coverage', 'missing')
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+    cooking_time = serializers.IntegerField(min_value=1, required=False)
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта строкой base64 из JSON или файлом из формы.
+
+    Файл из multipart/form-data уже лежит во временном файле; он
+    получает случайное имя, как и декодированная строка base64.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            image = super().to_internal_value(data)
+        else:
+            image = serializers.ImageField.to_internal_value(self, data)
+            extension = image.image.format.lower()
+            extension = 'jpg' if extension == 'jpeg' else extension
+            if extension not in self.ALLOWED_TYPES:
+                raise ValidationError(self.INVALID_TYPE_MESSAGE)
+            image.name = f'{self.get_file_name(None)}.{extension}'
+        if image is not None:
+            try:
+                check_upload_size(image.size)
+                check_image_size(*image.image.size)
+            except UploadRejected as error:
+                raise ValidationError(str(error))
+        return image
+
+
 class RecipesWriteSerializer(serializers.ModelSerializer):
     tags = TagsSerializer(many=True, read_only=True)
     ingredients = RecipeIngredientWriteSerializer(many=True)
@@ -108,7 +211,7 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
         read_only=True,
         default=serializers.CurrentUserDefault()
     )
-    image = Base64ImageField(max_length=None, use_url=True)
+    image = RecipeImageField(max_length=None, use_url=True)
 
     class Meta:
         model = Recipes
@@ -116,6 +219,7 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
                   'ingredients', 'cooking_time')
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], 'tags', ingredients_prefetch())
         serializer = RecipesReadSerializer(instance, context=self.context)
         return serializer.data
 
@@ -123,27 +227,63 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
         RecipeIngredient.objects.bulk_create([
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=get_object_or_404(
-                    Ingredient,
-                    pk=ingr.get('id')),
+                ingredient_id=ingr.get('id'),
                 amount=ingr.get('amount')
             ) for ingr in ingredients
         ])
 
-    def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
+    def validate_ingredients(self, ingredients):
         if not ingredients:
             raise ValidationError('Необходим хотя бы 1 ингредиент')
-        unique_ingredients = []
+        unique_ids, duplicates = set(), set()
         for ingredient in ingredients:
-            ingr_id = ingredient['id']
-            if ingr_id not in unique_ingredients:
-                unique_ingredients.append(ingr_id)
-            else:
-                raise ValidationError(
-                    'Уберите дубль ингредиента'
+            if ingredient['id'] in unique_ids:
+                duplicates.add(ingredient['id'])
+            unique_ids.add(ingredient['id'])
+        missing = unique_ids - set(Ingredient.objects.filter(
+            pk__in=unique_ids
+        ).values_list('pk', flat=True))
+        errors = []
+        if duplicates:
+            errors.append(
+                f'Уберите дубль ингредиента: {sorted(duplicates)}'
+            )
+        if missing:
+            errors.append(f'Ингредиенты не найдены: {sorted(missing)}')
+        if errors:
+            raise ValidationError(errors)
+        return ingredients
+
+    def validate_tags(self, tags):
+        """Проверяет id тегов из запроса одним запросом к базе."""
+        if not tags:
+            raise ValidationError('Необходим хотя бы 1 тег')
+        try:
+            tag_ids = [int(tag) for tag in tags]
+        except (TypeError, ValueError):
+            raise ValidationError('Теги задаются списком id')
+        unique_ids = set(tag_ids)
+        missing = unique_ids - set(Tags.objects.filter(
+            pk__in=unique_ids
+        ).values_list('pk', flat=True))
+        errors = []
+        if len(unique_ids) != len(tag_ids):
+            errors.append('Уберите дубль тега')
+        if missing:
+            errors.append(f'Теги не найдены: {sorted(missing)}')
+        if errors:
+            raise ValidationError(errors)
+        return tag_ids
+
+    def validate(self, attrs):
+        if 'tags' in self.initial_data or not self.partial:
+            try:
+                attrs['tags'] = self.validate_tags(
+                    self.initial_data.get('tags')
                 )
-        return data
+            except ValidationError as error:
+                raise ValidationError({'tags': error.detail})
+        return attrs
 
     def validate_cooking_time(self, data):
         cooking_time = self.initial_data.get('cooking_time')
@@ -151,9 +291,10 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
             raise ValidationError('Время приготовления должно быть больше 0')
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
-        tags = self.initial_data.get('tags')
+        tags = validated_data.pop('tags')
         cooking_time = validated_data.pop('cooking_time')
         author = serializers.CurrentUserDefault()(self)
         new_recipe = Recipes.objects.create(
@@ -163,15 +304,50 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
         )
         new_recipe.tags.set(tags)
         self.add_ingredients(new_recipe, ingredients)
+        publish_to_timelines(new_recipe)
         return new_recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Применяет к рецепту только разницу в составе ингредиентов."""
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.ingredients_amount.all()
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in existing.items()
+        }
+        new_amounts = {ingr['id']: ingr['amount'] for ingr in ingredients}
+        to_create, to_update = [], []
+        for ingredient_id, amount in new_amounts.items():
+            item = existing.get(ingredient_id)
+            if item is None:
+                to_create.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif item.amount != amount:
+                item.amount = amount
+                to_update.append(item)
+        to_delete = [
+            item.pk for ingredient_id, item in existing.items()
+            if ingredient_id not in new_amounts
+        ]
+        if not (to_create or to_update or to_delete):
+            return
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        if to_delete:
+            RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        update_shopping_lists(recipe.pk, old_amounts, new_amounts)
+
+    @transaction.atomic
     def update(self, recipe, validated_data):
         if "ingredients" in validated_data:
-            ingredients = validated_data.pop("ingredients")
-            recipe.ingredients_amount.all().delete()
-            self.add_ingredients(recipe, ingredients)
-        tags = self.initial_data.pop("tags")
-        recipe.tags.set(tags)
+            self.update_ingredients(recipe, validated_data.pop("ingredients"))
+        if "tags" in validated_data:
+            recipe.tags.set(validated_data.pop("tags"))
         return super().update(recipe, validated_data)
 
 
@@ -182,15 +358,42 @@ class FavoriteSerializer(serializers.ModelSerializer):
         fields = ('id',)
 
 
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
+    srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipes
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'srcset', 'cooking_time')
+
+
+class SimilarRecipeSerializer(RecipeListSerializer):
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('similarity',)
+
+
+class RankedRecipeSerializer(RecipeListSerializer):
+    score = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('score',)
 
 
 class FollowRecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipes
@@ -198,6 +401,7 @@ class FollowRecipeSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "image",
+            "srcset",
             "cooking_time",
         )
 
@@ -226,18 +430,18 @@ class FollowSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        return obj.user.follower.filter(author=obj.author).exists()
+        return True
 
     def get_recipes(self, obj):
-        queryset = (
-            obj.author.recipe.all().order_by('-pub_date'))
-        limit = self.context.get('request').query_params.get('recipes_limit')
-        if limit:
-            try:
-                queryset = queryset[:int(limit)]
-            except ValueError:
-                raise ValueError('Неверно задан параметр количества рецептов')
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            queryset = recipes[obj.author_id]
+        else:
+            queryset = obj.author.recipe.all().order_by('-pub_date')
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                queryset = queryset[:limit]
         return FollowRecipeSerializer(queryset, many=True).data
 
     def get_recipes_count(self, obj):
-        return obj.author.recipe.all().count()
+        return obj.author.recipes_count
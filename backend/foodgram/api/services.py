@@ -0,0 +1,477 @@
+import csv
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import (close_old_connections, connection, connections,
+                       router, transaction)
+from django.db.models import Count, F, Sum, Window
+from django.db.models.functions import Greatest, RowNumber
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from api.caching import bump_on_commit
+from recipes.models import (Favorite, FeedEntry, RecipeIngredient,
+                            RecipeRanking, Recipes, ShoppingCart,
+                            ShoppingList)
+
+User = get_user_model()
+
+CHUNK_SIZE = 2000
+PDF_FONT = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_MARGIN = 50
+SPOOL_MAX_SIZE = 1024 * 1024
+
+leaderboard_pool = None
+leaderboard_pool_lock = threading.Lock()
+
+
+def shopping_list(user):
+    """Ингредиенты из списка покупок пользователя."""
+    return ShoppingList.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name', 'ingredient__measurement_unit').iterator(
+        chunk_size=CHUNK_SIZE
+    )
+
+
+def insert_ignore(model, **values):
+    """Вставляет строку одним запросом, пропуская конфликт уникальности.
+
+    Возвращает False, если такая строка уже есть. В отличие от
+    exists() + create() не даёт гонки при двойном клике.
+    bulk_create(ignore_conflicts=True) здесь не подходит: он не
+    сообщает, вставилась ли строка, а число строк берётся из курсора.
+    """
+    query = InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [field for field in model._meta.local_concrete_fields
+         if not field.primary_key],
+        [model(**values)]
+    )
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using, savepoint=False):
+        with connections[using].cursor() as cursor:
+            for sql, params in query.get_compiler(using=using).as_sql():
+                cursor.execute(sql, params)
+            return cursor.rowcount > 0
+
+
+def can_return_inserted(db):
+    if db.vendor == 'sqlite':
+        return db.Database.sqlite_version_info >= (3, 35)
+    return db.features.can_return_rows_from_bulk_insert
+
+
+def insert_ignore_many(model, field, values, **common):
+    """Вставляет строки, пропуская уже существующие.
+
+    Возвращает значения field только у действительно вставленных строк:
+    прочитанное заранее множество имеющихся может устареть, пока идёт
+    вставка, и побочные действия применились бы дважды. Postgres и
+    SQLite 3.35+ отдают вставленные строки через RETURNING одним
+    запросом, на прочих базах строки вставляются по одной.
+    """
+    values = list(values)
+    using = router.db_for_write(model)
+    db = connections[using]
+    if len(values) < 2 or not can_return_inserted(db):
+        return {
+            value for value in values
+            if insert_ignore(model, **common, **{field: value})
+        }
+    query = InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [concrete for concrete in model._meta.local_concrete_fields
+         if not concrete.primary_key],
+        [model(**common, **{field: value}) for value in values]
+    )
+    (sql, params), = query.get_compiler(using=using).as_sql()
+    column = db.ops.quote_name(model._meta.get_field(field).column)
+    with transaction.atomic(using=using, savepoint=False):
+        with db.cursor() as cursor:
+            cursor.execute(f'{sql} RETURNING {column}', params)
+            return {row[0] for row in cursor.fetchall()}
+
+
+def counter_value(field, delta):
+    """Новое значение счётчика: уменьшение не уходит ниже нуля.
+
+    Если счётчик разошёлся с данными, вычитание из нуля нарушило бы
+    ограничение PositiveIntegerField и уронило запрос; расхождение
+    исправляет команда recount.
+    """
+    if delta < 0:
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет денормализованный счётчик без чтения записи."""
+    model.objects.filter(pk=pk).update(**{field: counter_value(field, delta)})
+
+
+def latest_recipes(author_ids, limit=None):
+    """Последние limit рецептов каждого автора одним запросом.
+
+    Django 3.2 не умеет фильтровать по оконным функциям, поэтому
+    нумерация ROW_NUMBER() по автору оборачивается во внешний запрос.
+    """
+    if not author_ids:
+        # Пустой IN () Django не переводит в SQL, а поднимает
+        # EmptyResultSet, который не ловится вне QuerySet.
+        return {}
+    ranked = Recipes.objects.filter(author_id__in=author_ids).only(
+        'id', 'author_id', 'name', 'image', 'image_variants', 'cooking_time'
+    ).annotate(position=Window(
+        RowNumber(),
+        partition_by=F('author_id'),
+        order_by=(F('pub_date').desc(), F('id').desc())
+    )).order_by()
+    sql, params = ranked.query.sql_with_params()
+    position = connection.ops.quote_name('position')
+    sql = f'SELECT * FROM ({sql}) ranked'
+    if limit is not None:
+        sql += f' WHERE {position} <= %s'
+        params += (limit,)
+    recipes = {author_id: [] for author_id in author_ids}
+    for recipe in Recipes.objects.raw(f'{sql} ORDER BY {position}', params):
+        recipes[recipe.author_id].append(recipe)
+    return recipes
+
+
+def change_counters(model, pks, field, delta):
+    model.objects.filter(pk__in=pks).update(
+        **{field: counter_value(field, delta)}
+    )
+
+
+def recipe_amounts(recipe_id):
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', 'amount'))
+
+
+@transaction.atomic
+def change_shopping_lists(user_ids, delta):
+    """Прибавляет delta {ingredient_id: количество} к спискам покупок."""
+    delta = {
+        ingredient_id: amount
+        for ingredient_id, amount in delta.items() if amount
+    }
+    if not user_ids or not delta:
+        return
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingList.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=delta
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, amount in delta.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                if amount > 0:
+                    to_create.append(ShoppingList(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        amount=amount
+                    ))
+                continue
+            item.amount += amount
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+    ShoppingList.objects.bulk_create(to_create)
+    ShoppingList.objects.bulk_update(to_update, ('amount',))
+    ShoppingList.objects.filter(pk__in=to_delete).delete()
+
+
+def total_amounts(recipe_ids):
+    """Суммарное количество каждого ингредиента в наборе рецептов."""
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).order_by().values_list('ingredient_id', 'total'))
+
+
+def add_to_shopping_list(user, recipe_ids):
+    change_shopping_lists([user.pk], total_amounts(recipe_ids))
+
+
+def remove_from_shopping_list(user, recipe_ids):
+    change_shopping_lists([user.pk], {
+        ingredient_id: -amount
+        for ingredient_id, amount in total_amounts(recipe_ids).items()
+    })
+
+
+def update_shopping_lists(recipe_id, old_amounts, new_amounts=None):
+    """Переносит изменение состава рецепта в списки покупок с ним."""
+    if new_amounts is None:
+        new_amounts = recipe_amounts(recipe_id)
+    delta = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in set(old_amounts) | set(new_amounts)
+    }
+    change_shopping_lists(list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True)), delta)
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids=None):
+    """Пересчитывает списки покупок с нуля по содержимому корзин."""
+    carts = ShoppingCart.objects.all()
+    items = ShoppingList.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    ingredient = 'recipe__ingredients_amount__ingredient_id'
+    totals = carts.filter(**{f'{ingredient}__isnull': False}).values(
+        'user_id', ingredient
+    ).annotate(
+        amount=Sum('recipe__ingredients_amount__amount')
+    ).order_by().iterator(chunk_size=CHUNK_SIZE)
+    batch = []
+    for total in totals:
+        batch.append(ShoppingList(
+            user_id=total['user_id'],
+            ingredient_id=total[ingredient],
+            amount=total['amount']
+        ))
+        if len(batch) == CHUNK_SIZE:
+            ShoppingList.objects.bulk_create(batch)
+            batch = []
+    ShoppingList.objects.bulk_create(batch)
+
+
+def leaderboard_scores(board):
+    """Пары (id рецепта, число добавлений) для рейтинга board."""
+    size = settings.LEADERBOARD_SIZE
+    if board == RecipeRanking.POPULAR:
+        return list(Recipes.objects.annotate(
+            score=F('favorites_count') + F('in_carts_count')
+        ).filter(score__gt=0).order_by('-score', '-id').values_list(
+            'id', 'score'
+        )[:size])
+    since = timezone.now() - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+    scores = Counter()
+    for model in (Favorite, ShoppingCart):
+        scores.update(dict(model.objects.filter(created__gte=since).values(
+            'recipe'
+        ).annotate(total=Count('pk')).order_by().values_list(
+            'recipe', 'total'
+        )))
+    return sorted(
+        scores.items(), key=lambda item: (-item[1], -item[0])
+    )[:size]
+
+
+@transaction.atomic
+def rebuild_leaderboard(board):
+    scores = leaderboard_scores(board)
+    RecipeRanking.objects.filter(board=board).delete()
+    RecipeRanking.objects.bulk_create(
+        RecipeRanking(
+            board=board, recipe_id=recipe_id, position=position, score=score
+        )
+        for position, (recipe_id, score) in enumerate(scores, 1)
+    )
+
+
+def refresh_leaderboard(board, force=False):
+    """Пересчитывает рейтинг, если он старше LEADERBOARD_TTL секунд.
+
+    Пока один процесс пересчитывает рейтинг, остальные отдают прежний.
+    """
+    fresh_key = f'leaderboard:{board}:fresh'
+    lock_key = f'leaderboard:{board}:lock'
+    if not force and cache.get(fresh_key):
+        return
+    if not cache.add(lock_key, True, settings.LEADERBOARD_TTL):
+        return
+    try:
+        rebuild_leaderboard(board)
+        bump_on_commit('leaderboards')
+        cache.set(fresh_key, True, settings.LEADERBOARD_TTL)
+    finally:
+        cache.delete(lock_key)
+
+
+def leaderboard_executor():
+    global leaderboard_pool
+    with leaderboard_pool_lock:
+        if leaderboard_pool is None:
+            leaderboard_pool = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='leaderboards'
+            )
+        return leaderboard_pool
+
+
+def schedule_leaderboard(board):
+    """Отдаёт пересчёт устаревшего рейтинга фоновому потоку.
+
+    Запрос сразу читает последний сохранённый рейтинг и пересчёта не
+    ждёт. По расписанию рейтинги пересчитывает refresh_leaderboards.
+    """
+    if cache.get_many((
+        f'leaderboard:{board}:fresh', f'leaderboard:{board}:lock'
+    )):
+        return
+
+    def work():
+        try:
+            refresh_leaderboard(board)
+        finally:
+            close_old_connections()
+    leaderboard_executor().submit(work)
+
+
+def has_timeline(following_count):
+    return following_count >= settings.FEED_TIMELINE_MIN_FOLLOWS
+
+
+def fill_timelines(recipes):
+    """Записывает рецепты в ленты подписчиков их авторов.
+
+    recipes — запрос к Recipes, уже ограниченный нужными читателями через
+    author__following__user.
+    """
+    rows = recipes.values_list(
+        'author__following__user', 'id', 'author_id', 'pub_date'
+    ).order_by().iterator(chunk_size=CHUNK_SIZE)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                   author_id=author_id, pub_date=pub_date)
+         for user_id, recipe_id, author_id, pub_date in rows),
+        batch_size=CHUNK_SIZE, ignore_conflicts=True
+    )
+
+
+def publish_to_timelines(recipe):
+    """Добавляет новый рецепт в собранные ленты подписчиков автора."""
+    fill_timelines(Recipes.objects.filter(
+        pk=recipe.pk,
+        author__following__user__following_count__gte=(
+            settings.FEED_TIMELINE_MIN_FOLLOWS
+        )
+    ))
+
+
+def change_following(user, added=(), removed=()):
+    """Меняет счётчик подписок пользователя и поддерживает его ленту.
+
+    Вызывается в транзакции после записи подписок. Лента собирается
+    целиком, когда подписок становится не меньше
+    FEED_TIMELINE_MIN_FOLLOWS, и удаляется, когда их становится меньше.
+    Строка пользователя блокируется, чтобы параллельные подписки не
+    пропустили момент пересечения порога.
+    """
+    following_count = User.objects.select_for_update().values_list(
+        'following_count', flat=True
+    ).get(pk=user.pk)
+    change_counter(
+        User, user.pk, 'following_count', len(added) - len(removed)
+    )
+    before = has_timeline(following_count)
+    after = has_timeline(following_count + len(added) - len(removed))
+    if before and not after:
+        FeedEntry.objects.filter(user=user).delete()
+    elif after and not before:
+        fill_timelines(Recipes.objects.filter(author__following__user=user))
+    elif after:
+        if removed:
+            FeedEntry.objects.filter(user=user, author_id__in=removed).delete()
+        if added:
+            fill_timelines(Recipes.objects.filter(
+                author_id__in=added, author__following__user=user
+            ))
+
+
+def rebuild_timelines():
+    """Пересобирает ленты всех пользователей с большим числом подписок."""
+    with transaction.atomic():
+        FeedEntry.objects.all().delete()
+        fill_timelines(Recipes.objects.filter(
+            author__following__user__following_count__gte=(
+                settings.FEED_TIMELINE_MIN_FOLLOWS
+            )
+        ))
+
+
+def shopping_list_lines(ingredients):
+    for number, ingredient in enumerate(ingredients, 1):
+        yield (
+            f'{number}) {ingredient["ingredient__name"]} - '
+            f'{ingredient["amount"]} '
+            f'({ingredient["ingredient__measurement_unit"]})'
+        )
+
+
+def shopping_list_txt(ingredients):
+    yield 'Список покупок: \n'
+    for line in shopping_list_lines(ingredients):
+        yield f'{line} \n'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit'],
+        ))
+
+
+def shopping_list_pdf(ingredients):
+    """Пишет PDF во временный файл, который уходит на диск при росте.
+
+    Формат PDF требует таблицу смещений в конце документа, поэтому файл
+    собирается целиком, но не в памяти процесса.
+    """
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(PDF_FONT, settings.SHOPPING_LIST_FONT))
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    pdf = canvas.Canvas(file, pagesize=A4)
+    width, height = A4
+    top = height - PDF_MARGIN
+    position = top
+    pdf.setFont(PDF_FONT, PDF_FONT_SIZE)
+    pdf.drawString(PDF_MARGIN, position, 'Список покупок:')
+    for line in shopping_list_lines(ingredients):
+        position -= PDF_LINE_HEIGHT
+        if position < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(PDF_FONT, PDF_FONT_SIZE)
+            position = top
+        pdf.drawString(PDF_MARGIN, position, line)
+    pdf.save()
+    file.seek(0)
+    return file
@@ -0,0 +1,131 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import forget_token, forget_user_tokens
+from api.caching import (bump_catalogue_version, bump_on_commit,
+                         user_lists_changed)
+from api.images import (acquire_blob, release_blob, release_variants,
+                        schedule_variants)
+from api.search import (index_recipe, recipe_ingredients_changed,
+                        unindex_recipe)
+from api.services import (change_counter, change_counters, recipe_amounts,
+                          update_shopping_lists)
+from recipes.models import Favorite, Ingredient, Recipes, ShoppingCart, Tags
+from users.models import Follow
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    bump_catalogue_version('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tags)
+def tag_changed(**kwargs):
+    bump_catalogue_version('tags')
+
+
+@receiver(pre_save, sender=Recipes)
+def recipe_saving(instance, update_fields=None, **kwargs):
+    # Прежние файл и автор нужны, чтобы после сохранения перенести ссылку
+    # на файл и счётчик рецептов.
+    if instance._state.adding:
+        instance._stored = None
+    elif update_fields is None or {'image', 'author'} & set(update_fields):
+        instance._stored = Recipes.objects.filter(pk=instance.pk).values(
+            'image', 'author_id'
+        ).first()
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_saved(instance, created, update_fields=None, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        index_recipe(instance)
+    if hasattr(instance, '_stored'):
+        stored = instance._stored or {'image': None, 'author_id': None}
+        del instance._stored
+        if stored['author_id'] not in (None, instance.author_id):
+            change_counter(User, stored['author_id'], 'recipes_count', -1)
+            change_counter(User, instance.author_id, 'recipes_count', 1)
+        if stored['image'] != instance.image.name:
+            if instance.image:
+                acquire_blob(instance.image.name)
+            if stored['image']:
+                release_blob(stored['image'])
+    if (instance.image
+            and instance.image_variants.get('source') != instance.image.name):
+        schedule_variants(instance.image.name)
+
+
+@receiver(pre_delete, sender=Recipes)
+def recipe_deleting(instance, **kwargs):
+    # Рецепт удаляется и через API, и из админки, и каскадом вместе с
+    # автором; состав и корзины ещё на месте только до удаления.
+    update_shopping_lists(instance.pk, recipe_amounts(instance.pk), {})
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_deleted(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+    unindex_recipe(instance)
+    if instance.image:
+        release_blob(instance.image.name)
+    transaction.on_commit(lambda: release_variants(instance.image_variants))
+
+
+@receiver((post_save, post_delete), sender=Recipes)
+def recipe_changed(instance, **kwargs):
+    # Ингредиенты и теги рецепта сохраняются в той же транзакции, что и
+    # сам рецепт, поэтому отдельные сигналы для них не нужны.
+    recipe_ingredients_changed(instance.pk)
+    bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def user_list_changed(instance, **kwargs):
+    # Отметки избранного и списка покупок накладываются на общий ответ
+    # из кеша списков пользователя, кто бы ни менял строки.
+    user_lists_changed(instance.user_id)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(instance, **kwargs):
+    # Списки и подписки пользователя удаляются каскадом, без сигналов:
+    # счётчики на другой стороне связей нужно уменьшить до удаления.
+    for model, field in ((Favorite, 'favorites_count'),
+                         (ShoppingCart, 'in_carts_count')):
+        change_counters(Recipes, model.objects.filter(
+            user=instance
+        ).values('recipe_id'), field, -1)
+    change_counters(User, Follow.objects.filter(
+        user=instance
+    ).values('author_id'), 'followers_count', -1)
+    change_counters(User, Follow.objects.filter(
+        author=instance
+    ).values('user_id'), 'following_count', -1)
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, update_fields=None, **kwargs):
+    # Автор входит в ответ о рецепте; у нового пользователя рецептов ещё
+    # нет, а вход в систему меняет только last_login.
+    if created:
+        return
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        bump_on_commit('recipes')
+        # Смена пароля и блокировка должны сразу закрыть доступ по
+        # токенам из кеша.
+        forget_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    forget_token(instance.key, instance.user_id)
@@ -0,0 +1,260 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import views
+from api.authentication import local_tokens
+from recipes.models import Favorite, Recipes, ShoppingCart
+
+User = get_user_model()
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f'user{number}@example.com', username=f'user{number}',
+        first_name='Имя', last_name='Фамилия', password='pass12345word'
+    )
+
+
+class ApiTestCase(TestCase):
+    """Пользователи и рецепты для проверок API.
+
+    Метки версий сбрасываются после фиксации транзакции, поэтому запросы,
+    которые что-то меняют, выполняются через self.commit.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1)
+        self.author = create_user(2)
+        self.recipes = [
+            Recipes.objects.create(
+                author=self.author, name=name, text='Описание'
+            )
+            for name in ('Блины', 'Каша', 'Омлет')
+        ]
+        self.recipe = self.recipes[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def commit(self, action, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return action(*args, **kwargs)
+
+    def marks(self):
+        """Отметки рецепта self.recipe в списке и на странице рецепта."""
+        listed = {
+            recipe['id']: recipe
+            for recipe in self.client.get('/api/recipes/').json()['results']
+        }
+        detail = self.client.get(f'/api/recipes/{self.recipe.pk}/').json()
+        marks = []
+        for recipe in (listed[self.recipe.pk], detail):
+            marks.append(
+                (recipe['is_favorited'], recipe['is_in_shopping_cart'])
+            )
+        self.assertEqual(marks[0], marks[1])
+        return marks[0]
+
+
+class UserListsOverlayTests(ApiTestCase):
+
+    def test_api_changes(self):
+        self.assertEqual(self.marks(), (False, False))
+        url = f'/api/recipes/{self.recipe.pk}'
+        self.commit(self.client.post, f'{url}/favorite/')
+        self.assertEqual(self.marks(), (True, False))
+        self.commit(self.client.post, f'{url}/shopping_cart/')
+        self.assertEqual(self.marks(), (True, True))
+        self.commit(self.client.delete, f'{url}/favorite/')
+        self.assertEqual(self.marks(), (False, True))
+        self.commit(self.client.delete, f'{url}/shopping_cart/')
+        self.assertEqual(self.marks(), (False, False))
+
+    def test_batch_changes(self):
+        self.assertEqual(self.marks(), (False, False))
+        ids = [recipe.pk for recipe in self.recipes]
+        for method, marks in (('post', (True, True)),
+                              ('delete', (False, False))):
+            for name in ('favorite', 'shopping_cart'):
+                self.commit(
+                    getattr(self.client, method),
+                    f'/api/recipes/{name}/', {'ids': ids}, format='json'
+                )
+            self.assertEqual(self.marks(), marks)
+
+    def test_orm_changes(self):
+        self.assertEqual(self.marks(), (False, False))
+        favorite = self.commit(
+            Favorite.objects.create, user=self.user, recipe=self.recipe
+        )
+        self.assertEqual(self.marks(), (True, False))
+        self.commit(
+            ShoppingCart.objects.create, user=self.user, recipe=self.recipe
+        )
+        self.assertEqual(self.marks(), (True, True))
+        self.commit(favorite.delete)
+        self.assertEqual(self.marks(), (False, True))
+        self.commit(ShoppingCart.objects.filter(user=self.user).delete)
+        self.assertEqual(self.marks(), (False, False))
+
+
+class TokenCacheTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.client = self.token_client()
+
+    def token_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def test_logout(self):
+        other = self.token_client()
+        self.assertEqual(other.get('/api/recipes/').status_code, 200)
+        response = self.commit(self.client.post, '/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(other.get('/api/recipes/').status_code, 401)
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 401)
+
+    def test_logout_in_other_process(self):
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+        # Удаление в другом процессе не трогает здешнюю копию в памяти.
+        with mock.patch.object(local_tokens, 'delete'):
+            self.commit(self.token.delete)
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 401)
+
+    def test_deactivation(self):
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+        self.user.is_active = False
+        self.commit(self.user.save)
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 401)
+
+    def test_user_fields_from_database(self):
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(username='renamed')
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['username'], 'renamed')
+
+
+class CounterTests(ApiTestCase):
+
+    def test_save_keeps_counters(self):
+        stale = Recipes.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        stale.text = 'Новое описание'
+        stale.save()
+        author.first_name = 'Другое'
+        author.save()
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.text, 'Новое описание')
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.author.first_name, 'Другое')
+
+
+class ShoppingCartDownloadTests(ApiTestCase):
+
+    def download(self, query='', **headers):
+        return self.client.get(
+            f'/api/recipes/download_shopping_cart/{query}', **headers
+        )
+
+    def test_formats(self):
+        for query, headers, content_type in (
+            ('', {}, 'text/plain'),
+            ('?format=csv', {}, 'text/csv'),
+            ('', {'HTTP_ACCEPT': 'text/csv'}, 'text/csv'),
+            ('', {'HTTP_ACCEPT': 'application/json'}, 'text/plain'),
+            ('?format=xlsx', {}, 'text/plain'),
+        ):
+            response = self.download(query, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith(content_type))
+
+
+class SearchTests(ApiTestCase):
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('бли'), ['Блины'])
+        self.assertEqual(len(self.search('опис')), 3)
+        self.assertEqual(self.search('блины опис'), ['Блины'])
+        self.assertEqual(self.search('суп'), [])
+
+    def test_name_ranks_above_text(self):
+        Recipes.objects.create(
+            author=self.author, name='Оладьи', text='Почти как блины'
+        )
+        self.assertEqual(self.search('блины'), ['Блины', 'Оладьи'])
+
+
+class DuplicateInsertTests(ApiTestCase):
+
+    def test_lists(self):
+        for name, field in (('favorite', 'favorites_count'),
+                            ('shopping_cart', 'in_carts_count')):
+            url = f'/api/recipes/{self.recipe.pk}/{name}/'
+            self.assertEqual(self.client.post(url).status_code, 201)
+            self.assertEqual(self.client.post(url).status_code, 400)
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, field), 1)
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class BatchTests(ApiTestCase):
+
+    def statuses(self, response):
+        return [result['status'] for result in response.json()['results']]
+
+    def test_results_cover_inserted_rows(self):
+        first, second, third = self.recipes
+        self.client.post(f'/api/recipes/{first.pk}/favorite/')
+        insert = views.insert_ignore_many
+
+        def racing_insert(model, field, values, **common):
+            # Параллельный запрос успевает добавить рецепт между проверкой
+            # и вставкой.
+            Favorite.objects.create(user=self.user, recipe=second)
+            return insert(model, field, values, **common)
+
+        with mock.patch.object(views, 'insert_ignore_many', racing_insert):
+            response = self.client.post(
+                '/api/recipes/favorite/',
+                {'ids': [first.pk, second.pk, third.pk, 0]}, format='json'
+            )
+        self.assertEqual(self.statuses(response), [400, 400, 201, 404])
+        counts = dict(Recipes.objects.values_list('pk', 'favorites_count'))
+        self.assertEqual(
+            [counts[recipe.pk] for recipe in self.recipes], [1, 0, 1]
+        )
+
+    def test_subscribe(self):
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        other = create_user(3)
+        response = self.client.post(
+            '/api/users/subscribe/',
+            {'ids': [self.author.pk, other.pk, self.user.pk, 0]},
+            format='json'
+        )
+        self.assertEqual(self.statuses(response), [400, 201, 400, 404])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.following_count, 2)
@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from api.views import (FollowUserView, IngredientViewSet, RecipesViewSet,
-                       SubscriptionsView, TagsViewSet)
+from api.views import (FollowBatchView, FollowUserView, IngredientViewSet,
+                       RecipesViewSet, SubscriptionsView, TagsViewSet)
 
 router = routers.DefaultRouter()
 router.register('recipes', RecipesViewSet, basename="recipes")
@@ -11,6 +11,7 @@ router.register('ingredients', IngredientViewSet, basename='ingredients')
 
 urlpatterns = [
     path('users/subscriptions/', SubscriptionsView.as_view()),
+    path('users/subscribe/', FollowBatchView.as_view()),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
@@ -1,82 +1,180 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, Exists, F, OuterRef, Value
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.paginators import CustomPagination
+from api.caching import (cached_catalogue_response, recipes_response_key,
+                         user_lists_changed, with_user_lists)
+from api.filters import (RecipeFilter, RecipeRankingFilter,
+                         RecipeSearchFilter)
+from api.paginators import (CustomPagination, RankedPagination,
+                            SubscriptionsPagination, TimelinePagination)
+from api.parsers import RecipeMultiPartParser
 from api.permissions import IsAuthorOrReadOnly
-from api.serializers import (FavoriteSerializer, FollowSerializer,
-                             IngredientSerializer, RecipeListSerializer,
-                             RecipesWriteSerializer, TagsSerializer)
-from recipes.models import Favorite, Ingredient, Recipes, ShoppingCart, Tags
+from api.renderers import (CSVRenderer, FirstRendererFallback, PDFRenderer,
+                           TXTRenderer)
+from api.search import ingredient_index, pantry_index
+from api.serializers import (BatchSerializer, FavoriteSerializer,
+                             FollowSerializer, IngredientSerializer,
+                             PantryQuerySerializer, PantryRecipeSerializer,
+                             RankedRecipeSerializer, RecipeListSerializer,
+                             RecipesWriteSerializer, ShoppingListSerializer,
+                             SimilarRecipeSerializer, TagsSerializer,
+                             ingredients_prefetch)
+from api.services import (add_to_shopping_list, change_counter,
+                          change_counters, change_following, has_timeline,
+                          insert_ignore, insert_ignore_many, latest_recipes,
+                          remove_from_shopping_list, schedule_leaderboard,
+                          shopping_list, shopping_list_csv, shopping_list_pdf,
+                          shopping_list_txt)
+from recipes.models import (Favorite, FeedEntry, Ingredient, RecipeRanking,
+                            Recipes, ShoppingCart, Tags)
+from users.models import Follow
 
 User = get_user_model()
 
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
 
-class RecipesViewSet(viewsets.ModelViewSet):
-    queryset = Recipes.objects.all()
-    filter_backends = (DjangoFilterBackend,)
-    filter_class = RecipeFilter
-    permission_classes = (IsAuthorOrReadOnly,)
-    pagination_class = CustomPagination
 
+def batch_result(pk, code, errors=None):
+    result = {'id': pk, 'status': code}
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+class RecipesViewSet(viewsets.ModelViewSet):
     queryset = Recipes.objects.all()
-    filter_backends = (DjangoFilterBackend,)
-    filter_class = RecipeFilter
-    filterset_fields = ('tags',)
+    filter_backends = (
+        DjangoFilterBackend, RecipeSearchFilter, RecipeRankingFilter
+    )
+    filterset_class = RecipeFilter
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = CustomPagination
+    parser_classes = (JSONParser, FormParser, RecipeMultiPartParser)
 
     def get_serializer_class(self):
         if self.action == 'favorite' or self.action == 'shopping_cart':
             return FavoriteSerializer
+        if self.action == 'shopping_list':
+            return ShoppingListSerializer
+        if self.action in ('favorite_batch', 'shopping_cart_batch'):
+            return BatchSerializer
+        if self.action == 'cook':
+            return PantryRecipeSerializer
+        if self.action == 'similar':
+            return SimilarRecipeSerializer
+        if self.action == 'top':
+            return RankedRecipeSerializer
         return RecipesWriteSerializer
 
+    # Фильтры, из-за которых ответ зависит от пользователя целиком.
+    personal_params = ('is_favorited', 'is_in_shopping_cart')
+    shared = False
+
     def get_queryset(self):
-        queryset = Recipes.objects.all()
-        author = self.request.user
+        user = self.request.user
+        queryset = Recipes.objects.select_related('author').prefetch_related(
+            'tags', ingredients_prefetch()
+        )
+        if user.is_authenticated and not self.shared:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')))
+            )
+        else:
+            queryset = queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
         if self.request.GET.get('is_favorited'):
-            favorite_recipes_ids = Favorite.objects.filter(
-                user=author).values('recipe_id')
-
-            return queryset.filter(pk__in=favorite_recipes_ids)
-
+            return queryset.filter(is_favorited=True)
         if self.request.GET.get('is_in_shopping_cart'):
-            cart_recipes_ids = ShoppingCart.objects.filter(
-                user=author).values('recipe_id')
-            return queryset.filter(pk__in=cart_recipes_ids)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
-    def add_in_list(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
-            return Response(
-                {'errors': f'Рецепт уже добавлен в {model.__name__}'},
-                status=status.HTTP_400_BAD_REQUEST
+    def shared_data(self, request, build, extra=()):
+        """Ответ без отметок пользователя: из кеша или от build.
+
+        Собирается как для анонима и хранится под версиями данных, отметки
+        избранного и списка покупок накладываются уже после кеша.
+        """
+        key = recipes_response_key(request, extra)
+        data = cache.get(key)
+        if data is None:
+            self.shared = True
+            data = build().data
+            cache.set(key, data, settings.RECIPES_CACHE_TIMEOUT)
+        return data
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if any(params.get(name) for name in self.personal_params):
+            return super().list(request, *args, **kwargs)
+        data = self.shared_data(
+            request, lambda: super(RecipesViewSet, self).list(
+                request, *args, **kwargs
+            ),
+            ('leaderboards',) if params.get('ordering') else ()
+        )
+        return Response(dict(
+            data, results=with_user_lists(data['results'], request.user)
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        data = self.shared_data(
+            request, lambda: super(RecipesViewSet, self).retrieve(
+                request, *args, **kwargs
             )
+        )
+        return Response(with_user_lists([data], request.user)[0])
+
+    def add_in_list(self, model, user, pk):
         recipe = get_object_or_404(Recipes, pk=pk)
-        model.objects.create(user=user, recipe=recipe)
+        with transaction.atomic():
+            if not insert_ignore(model, user=user, recipe=recipe):
+                return Response(
+                    {'errors': f'Рецепт уже добавлен в {model.__name__}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            change_counter(Recipes, recipe.pk, RECIPE_COUNTERS[model], 1)
+            if model is ShoppingCart:
+                add_to_shopping_list(user, [recipe.pk])
+            # Вставка идёт в обход ORM, и сигнал post_save не приходит.
+            user_lists_changed(user.pk)
         serializer = RecipeListSerializer(recipe)
         return Response(serializer.data,
                         status=status.HTTP_201_CREATED)
 
     def delete_in_list(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            {'errors': f'Рецепт не добавлен в {model.__name__}'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(user=user, recipe_id=pk).delete()
+            if not deleted:
+                return Response(
+                    {'errors': f'Рецепт не добавлен в {model.__name__}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            change_counter(Recipes, pk, RECIPE_COUNTERS[model], -1)
+            if model is ShoppingCart:
+                remove_from_shopping_list(user, [pk])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=(IsAuthenticated,))
@@ -92,27 +190,190 @@ class RecipesViewSet(viewsets.ModelViewSet):
             return self.add_in_list(ShoppingCart, request.user, pk)
         return self.delete_in_list(ShoppingCart, request.user, pk)
 
+    def add_many_in_list(self, model, user, ids):
+        found = set(Recipes.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True
+        ))
+        present = set(model.objects.filter(
+            user=user, recipe_id__in=found
+        ).values_list('recipe_id', flat=True))
+        added = insert_ignore_many(
+            model, 'recipe_id', found - present, user=user
+        )
+        if added:
+            change_counters(Recipes, added, RECIPE_COUNTERS[model], 1)
+            if model is ShoppingCart:
+                add_to_shopping_list(user, added)
+            # Вставка идёт в обход ORM, и сигнал post_save не приходит.
+            user_lists_changed(user.pk)
+        results = []
+        for pk in ids:
+            if pk in added:
+                results.append(batch_result(pk, status.HTTP_201_CREATED))
+            elif pk in found:
+                results.append(batch_result(
+                    pk, status.HTTP_400_BAD_REQUEST,
+                    f'Рецепт уже добавлен в {model.__name__}'
+                ))
+            else:
+                results.append(batch_result(
+                    pk, status.HTTP_404_NOT_FOUND, 'Рецепт не найден'
+                ))
+        return results
+
+    def delete_many_in_list(self, model, user, ids):
+        present = set(model.objects.filter(
+            user=user, recipe_id__in=ids
+        ).values_list('recipe_id', flat=True))
+        if present:
+            model.objects.filter(user=user, recipe_id__in=present).delete()
+            change_counters(Recipes, present, RECIPE_COUNTERS[model], -1)
+            if model is ShoppingCart:
+                remove_from_shopping_list(user, present)
+        return [
+            batch_result(pk, status.HTTP_204_NO_CONTENT) if pk in present
+            else batch_result(pk, status.HTTP_400_BAD_REQUEST,
+                              f'Рецепт не добавлен в {model.__name__}')
+            for pk in ids
+        ]
+
+    @transaction.atomic
+    def change_many_in_list(self, request, model):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            results = self.add_many_in_list(model, request.user, ids)
+        else:
+            results = self.delete_many_in_list(model, request.user, ids)
+        return Response({'results': results})
+
+    @action(methods=['post', 'delete'], detail=False, url_path='favorite',
+            permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        return self.change_many_in_list(request, Favorite)
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart', permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        return self.change_many_in_list(request, ShoppingCart)
+
+    @action(methods=['GET'], detail=False,
+            pagination_class=RankedPagination)
+    def cook(self, request):
+        """Рецепты из имеющихся продуктов: ?ingredients=1&ingredients=2."""
+        query = PantryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        page = self.paginate_queryset(pantry_index.search(
+            query.validated_data['ingredients'],
+            query.validated_data.get('max_missing'),
+            query.validated_data.get('cooking_time')
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        found = []
+        for recipe_id, matched, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = round(matched / total, 4)
+            recipe.missing = total - matched
+            found.append(recipe)
+        serializer = self.get_serializer(found, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Похожие рецепты из таблицы, которую строит build_similarity."""
+        limit = query_limit(request, settings.SIMILAR_RECIPES_LIMIT)
+        recipes = Recipes.objects.filter(similar_for__recipe_id=pk).annotate(
+            similarity=F('similar_for__score')
+        ).order_by('-similarity', '-id')[:limit]
+        data = self.get_serializer(recipes, many=True).data
+        if not data:
+            get_object_or_404(Recipes, pk=pk)
+        return Response(data)
+
+    @action(methods=['GET'], detail=False)
+    def top(self, request):
+        """Первые места рейтинга: ?board=popular или ?board=trending."""
+        board = request.query_params.get('board', RecipeRanking.POPULAR)
+        if board not in dict(RecipeRanking.BOARDS):
+            raise ValidationError({'board': 'Неизвестный рейтинг'})
+        limit = query_limit(request, settings.LEADERBOARD_SIZE)
+        schedule_leaderboard(board)
+        recipes = Recipes.objects.filter(rankings__board=board).annotate(
+            score=F('rankings__score')
+        ).order_by('rankings__position')[:limit]
+        return Response(self.get_serializer(recipes, many=True).data)
+
     @action(methods=['GET'], detail=False,
             permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь.
+
+        Читателям с большим числом подписок лента отдаётся из заранее
+        собранной таблицы FeedEntry, остальным — соединением подписок с
+        рецептами по индексу (author, pub_date).
+        """
+        user = request.user
+        # Поле не хранится в кеше токенов и читается из базы.
+        if not has_timeline(user.following_count):
+            page = self.paginate_queryset(
+                self.get_queryset().filter(author__following__user=user)
+            )
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        paginator = TimelinePagination()
+        entries = paginator.paginate_queryset(
+            FeedEntry.objects.filter(user=user), request, self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        serializer = self.get_serializer([
+            recipes[entry.recipe_id] for entry in entries
+            if entry.recipe_id in recipes
+        ], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=(IsAuthenticated,))
+    def shopping_list(self, request):
+        serializer = self.get_serializer(
+            request.user.shopping_list.select_related('ingredient').order_by(
+                'ingredient__name', 'ingredient__measurement_unit'
+            ),
+            many=True
+        )
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(TXTRenderer, CSVRenderer, PDFRenderer),
+            content_negotiation_class=FirstRendererFallback)
     def download_shopping_cart(self, request):
-        ingredients = request.user.shopping_cart.values(
-            'recipe__ingredients_amount__ingredient__name',
-            'recipe__ingredients_amount__ingredient__measurement_unit'
-        ).annotate(amount=Sum('recipe__ingredients_amount__amount'))
-        shopping_list = 'Список покупок: \n'
-        count_ingredients = 0
-        for ingr in ingredients:
-            count_ingredients += 1
-            shopping_list += (
-                f'{count_ingredients}) '
-                f'{ingr["recipe__ingredients_amount__ingredient__name"]} - '
-                f'{ingr["amount"]} '
-                f'({ingr["recipe__ingredients_amount__ingredient__measurement_unit"]}) \n'
+        export_format = request.accepted_renderer.format
+        filename = f'{request.user.username} shopping list.{export_format}'
+        ingredients = shopping_list(request.user)
+        if export_format == 'pdf':
+            return FileResponse(
+                shopping_list_pdf(ingredients),
+                as_attachment=True,
+                filename=filename,
+                content_type=request.accepted_media_type
             )
-        response = HttpResponse(shopping_list, 'Content-Type: text/plain')
+        if export_format == 'csv':
+            content = shopping_list_csv(ingredients)
+        else:
+            content = shopping_list_txt(ingredients)
+        response = StreamingHttpResponse(
+            content, content_type=f'{request.accepted_media_type}; '
+                                  'charset=utf-8'
+        )
         response['Content-Disposition'] = (
-            f'attachment; '
-            f'filename="{self.request.user.username} shopping list.txt"'
+            f'attachment; filename="{filename}"'
         )
         return response
 
@@ -122,52 +383,177 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagsSerializer
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return cached_catalogue_response(
+            request, 'tags',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """ Вывод ингредиентов """
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return cached_catalogue_response(request, 'ingredients', self.search)
+
+    def search(self):
+        name = self.request.query_params.get('name')
+        if not name:
+            return ingredient_index.all()
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return ingredient_index.search(name, limit)
+
+
+def query_limit(request, default):
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': 'Неверно задан лимит'})
+    return max(limit, 0)
+
+
+def recipes_limit(request):
+    limit = request.query_params.get('recipes_limit')
+    if limit is None:
+        return None
+    try:
+        return int(limit)
+    except ValueError:
+        raise ValidationError(
+            {'recipes_limit': 'Неверно задан параметр количества рецептов'}
+        )
+
 
 class FollowUserView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, id):
         author = get_object_or_404(User, id=id)
-        if request.user.follower.filter(author=author).exists():
+        if author == request.user:
             return Response(
-                {"errors": "Вы уже подписаны на автора"},
+                {"errors": "Нельзя подписаться на самого себя"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        with transaction.atomic():
+            if not insert_ignore(Follow, user=request.user, author=author):
+                return Response(
+                    {"errors": "Вы уже подписаны на автора"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            change_counter(User, author.pk, 'followers_count', 1)
+            change_following(request.user, added=[author.pk])
         serializer = FollowSerializer(
-            request.user.follower.create(author=author),
-            context={"request": request},
+            Follow(user=request.user, author=author),
+            context={
+                "request": request,
+                "recipes_limit": recipes_limit(request),
+            }
         )
         return Response(
             serializer.data, status=status.HTTP_201_CREATED
         )
 
     def delete(self, request, id):
-        author = get_object_or_404(User, id=id)
-        if request.user.follower.filter(author=author).exists():
-            request.user.follower.filter(
-                author=author
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            deleted, _ = request.user.follower.filter(author_id=id).delete()
+            if deleted:
+                change_counter(User, id, 'followers_count', -1)
+                change_following(request.user, removed=[id])
+                return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(User, id=id)
         return Response(
             {"errors": "Автор отсутсвует в списке подписок"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
 
+class FollowBatchView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @transaction.atomic
+    def post(self, request):
+        ids = self.get_ids(request)
+        found = set(User.objects.filter(pk__in=ids).exclude(
+            pk=request.user.pk
+        ).values_list('pk', flat=True))
+        present = set(request.user.follower.filter(
+            author_id__in=found
+        ).values_list('author_id', flat=True))
+        added = insert_ignore_many(
+            Follow, 'author_id', found - present, user=request.user
+        )
+        if added:
+            change_counters(User, added, 'followers_count', 1)
+            change_following(request.user, added=added)
+        results = []
+        for pk in ids:
+            if pk in added:
+                results.append(batch_result(pk, status.HTTP_201_CREATED))
+            elif pk in found:
+                results.append(batch_result(
+                    pk, status.HTTP_400_BAD_REQUEST,
+                    'Вы уже подписаны на автора'
+                ))
+            elif pk == request.user.pk:
+                results.append(batch_result(
+                    pk, status.HTTP_400_BAD_REQUEST,
+                    'Нельзя подписаться на самого себя'
+                ))
+            else:
+                results.append(batch_result(
+                    pk, status.HTTP_404_NOT_FOUND, 'Автор не найден'
+                ))
+        return Response({'results': results})
+
+    @transaction.atomic
+    def delete(self, request):
+        ids = self.get_ids(request)
+        present = set(request.user.follower.filter(
+            author_id__in=ids
+        ).values_list('author_id', flat=True))
+        if present:
+            request.user.follower.filter(author_id__in=present).delete()
+            change_counters(User, present, 'followers_count', -1)
+            change_following(request.user, removed=present)
+        return Response({'results': [
+            batch_result(pk, status.HTTP_204_NO_CONTENT) if pk in present
+            else batch_result(pk, status.HTTP_400_BAD_REQUEST,
+                              'Автор отсутсвует в списке подписок')
+            for pk in ids
+        ]})
+
+    def get_ids(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+
 class SubscriptionsView(ListAPIView):
     serializer_class = FollowSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = SubscriptionsPagination
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        return self.request.user.follower.all()
+        return self.request.user.follower.select_related('author')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = recipes_limit(self.request)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        follows = self.paginate_queryset(self.get_queryset())
+        context = self.get_serializer_context()
+        context['recipes'] = latest_recipes(
+            [follow.author_id for follow in follows],
+            context['recipes_limit']
+        )
+        serializer = self.get_serializer(follows, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
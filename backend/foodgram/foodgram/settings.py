@@ -90,6 +90,32 @@ DATABASES = {
 #     }
 # }
 
+# Кеш в памяти процесса годится только для разработки: метки версий,
+# сброшенные другими процессами и командами manage.py, в нём не видны.
+# check --deploy требует общий кеш.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60 * 24
+
+RECIPES_CACHE_TIMEOUT = int(
+    os.getenv('RECIPES_CACHE_TIMEOUT', default=60 * 10)
+)
+
+# Псевдоним кеша из CACHES для токенов и их меток; метки сверяются на
+# каждом запросе, поэтому кеш должен быть общим для всех процессов.
+AUTH_TOKEN_CACHE = os.getenv('AUTH_TOKEN_CACHE', default='default')
+AUTH_TOKEN_CACHE_TTL = 60 * 5
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_LOCAL_TTL = 30
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -124,6 +150,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Ширина уменьшенных копий изображения рецепта: карточка, страница
+# рецепта и страница рецепта на экранах с двойной плотностью.
+IMAGE_VARIANTS = (
+    ('card', 320),
+    ('detail', 800),
+    ('retina', 1600),
+)
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+IMAGE_UPLOAD_MAX_DIMENSION = 8000
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
@@ -155,7 +193,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
@@ -171,6 +209,22 @@ MAX_LENGTH_TAGS_COLOR = 7
 MAX_LENGTH_TAGS_SLUG = 200
 MAX_LENGTH_RECIPES = 200
 
+INGREDIENT_SEARCH_LIMIT = 50
+
+BATCH_MAX_SIZE = 100
+
+SIMILAR_RECIPES_LIMIT = 10
+
+LEADERBOARD_SIZE = 100
+
+LEADERBOARD_TTL = 300
+
+TRENDING_WINDOW_DAYS = 7
+
+FEED_TIMELINE_MIN_FOLLOWS = 50
+
+SHOPPING_LIST_FONT = os.path.join(BASE_DIR, 'data', 'fonts', 'DejaVuSans.ttf')
+
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
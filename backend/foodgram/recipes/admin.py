@@ -1,5 +1,10 @@
 from django.contrib import admin
+from django.db import transaction
 
+from api.caching import user_lists_changed
+from api.services import (add_to_shopping_list, change_counter,
+                          recipe_amounts, remove_from_shopping_list,
+                          update_shopping_lists)
 from recipes.models import (Favorite, Ingredient, RecipeIngredient, Recipes,
                             ShoppingCart, Tags)
 
@@ -11,13 +16,19 @@ class RecipeIngredientInline(admin.StackedInline):
 
 @admin.register(Recipes)
 class RecipesAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorite_count',)
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count',)
     list_filter = ('name', 'author', 'tags')
-    readonly_fields = ('favorite_count',)
+    readonly_fields = ('favorites_count', 'in_carts_count',)
     inlines = [RecipeIngredientInline]
 
-    def favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+    def save_related(self, request, form, formsets, change):
+        # Состав рецепта меняется в инлайне, минуя сериализатор: разницу
+        # нужно перенести в списки покупок тех, у кого рецепт в корзине.
+        if not change:
+            return super().save_related(request, form, formsets, change)
+        old_amounts = recipe_amounts(form.instance.pk)
+        super().save_related(request, form, formsets, change)
+        update_shopping_lists(form.instance.pk, old_amounts)
 
 
 @admin.register(Ingredient)
@@ -32,11 +43,59 @@ class TagsAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug')
 
 
-@admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class UserListAdmin(admin.ModelAdmin):
+    """Правки списков рецептов из админки.
+
+    Изменение строки проводится как удаление прежней и добавление новой,
+    чтобы зависящие от списков данные обновлялись так же, как в API.
+    """
     list_display = ('user', 'recipe')
 
+    counter = None
+
+    def added(self, obj):
+        change_counter(Recipes, obj.recipe_id, self.counter, 1)
+
+    def removed(self, obj):
+        change_counter(Recipes, obj.recipe_id, self.counter, -1)
+
+    def save_model(self, request, obj, form, change):
+        moved = not change or {'user', 'recipe'} & set(form.changed_data)
+        if change and moved:
+            stored = self.model.objects.get(pk=obj.pk)
+            self.removed(stored)
+            # Строка не удаляется, а меняется: сигнал сохранения сбросит
+            # списки только нового владельца.
+            user_lists_changed(stored.user_id)
+        super().save_model(request, obj, form, change)
+        if moved:
+            self.added(obj)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.removed(obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        removed = list(queryset.select_related('user'))
+        super().delete_queryset(request, queryset)
+        for obj in removed:
+            self.removed(obj)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(UserListAdmin):
+    counter = 'favorites_count'
+
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe')
+class ShoppingCartAdmin(UserListAdmin):
+    counter = 'in_carts_count'
+
+    def added(self, obj):
+        super().added(obj)
+        add_to_shopping_list(obj.user, [obj.recipe_id])
+
+    def removed(self, obj):
+        super().removed(obj)
+        remove_from_shopping_list(obj.user, [obj.recipe_id])
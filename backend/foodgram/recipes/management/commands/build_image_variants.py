@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.images import process_image
+from recipes.models import Recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные копии изображений рецептов в WebP и JPEG. '
+        'По умолчанию обрабатывает только изображения без актуальных копий; '
+        'одно изображение обрабатывается один раз для всех рецептов с ним.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Перестроить копии всех изображений.')
+        parser.add_argument('--workers', type=int,
+                            default=max(settings.IMAGE_WORKERS, 1),
+                            help='Сколько изображений обрабатывать '
+                                 'параллельно.')
+
+    def handle(self, *args, **options):
+        self.rebuild = options['all']
+        sources = {}
+        for source, variants in Recipes.objects.values_list(
+            'image', 'image_variants'
+        ).iterator():
+            if source and (options['all']
+                           or variants.get('source') != source):
+                sources[source] = None
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            failed = [
+                (source, error) for source, error in zip(
+                    sources, pool.map(self.process, sources)
+                ) if error
+            ]
+        for source, error in failed:
+            self.stderr.write(f'Не удалось обработать {source}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {len(sources) - len(failed)}.'
+        ))
+
+    def process(self, source):
+        try:
+            process_image(source, rebuild=self.rebuild)
+        except Exception as error:
+            return error
+        finally:
+            close_old_connections()
@@ -0,0 +1,177 @@
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from scipy import sparse
+
+from recipes.models import RecipeIngredient, Recipes, SimilarRecipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассчитывает таблицу похожих рецептов по косинусному сходству '
+        'ингредиентов и тегов. По умолчанию пересчитывает только рецепты, '
+        'изменённые с прошлого запуска, и те, чьи списки они затрагивают.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все рецепты.')
+        parser.add_argument('--top', type=int,
+                            default=settings.SIMILAR_RECIPES_LIMIT,
+                            help='Сколько похожих рецептов хранить.')
+        parser.add_argument('--tag-weight', type=float, default=0.5,
+                            help='Вес тега относительно ингредиента.')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Сколько строк матрицы сходства '
+                                 'считать за раз.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        self.top = options['top']
+        self.chunk_size = options['chunk_size']
+        self.recipe_ids = list(
+            Recipes.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.positions = {
+            recipe_id: row for row, recipe_id in enumerate(self.recipe_ids)
+        }
+        self.matrix = self.vectors(options['tag_weight'])
+        stale = Recipes.objects.filter(
+            Q(similar_built__isnull=True) | Q(similar_built__lt=F('updated'))
+        )
+        changed = [] if options['full'] else list(
+            stale.values_list('id', flat=True)
+        )
+        full = options['full'] or len(changed) * 2 > len(self.recipe_ids)
+        if full:
+            targets = list(range(len(self.recipe_ids)))
+        elif not changed:
+            self.stdout.write('Изменённых рецептов нет.')
+            return
+        else:
+            targets = self.affected(changed)
+        rows = (
+            SimilarRecipe(
+                recipe_id=self.recipe_ids[row],
+                similar_id=self.recipe_ids[column],
+                score=score,
+            )
+            for row, column, score in self.neighbours(targets)
+        )
+        with transaction.atomic():
+            if full:
+                SimilarRecipe.objects.all().delete()
+                built = Recipes.objects.filter(pk__in=self.recipe_ids)
+            else:
+                SimilarRecipe.objects.filter(recipe_id__in=[
+                    self.recipe_ids[row] for row in targets
+                ]).delete()
+                built = Recipes.objects.filter(pk__in=changed)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                SimilarRecipe.objects.bulk_create(batch)
+            # Метка ставится временем начала: рецепты, изменённые во время
+            # расчёта, останутся устаревшими до следующего запуска.
+            built.update(similar_built=started)
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты рассчитаны для {len(targets)} рецептов.'
+        ))
+
+    def vectors(self, tag_weight):
+        """Нормированная разреженная матрица «рецепт × ингредиент и тег»."""
+        columns = {}
+        rows, cols, data = [], [], []
+
+        def add(recipe_id, feature, weight):
+            row = self.positions.get(recipe_id)
+            if row is None:
+                return
+            rows.append(row)
+            cols.append(columns.setdefault(feature, len(columns)))
+            data.append(weight)
+
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator():
+            add(recipe_id, ('ingredient', ingredient_id), 1.0)
+        for recipe_id, tag_id in Recipes.tags.through.objects.values_list(
+            'recipes_id', 'tags_id'
+        ).iterator():
+            add(recipe_id, ('tag', tag_id), tag_weight)
+        matrix = sparse.csr_matrix(
+            (data, (rows, cols)),
+            shape=(len(self.recipe_ids), len(columns) or 1)
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(matrix.multiply(1 / norms))
+
+    def affected(self, changed):
+        """Строки, чьи списки похожих могут измениться из-за changed.
+
+        Это сами изменённые рецепты, рецепты, в чьих списках они уже
+        есть, и рецепты, для которых изменённый рецепт теперь ближе
+        последнего соседа в списке.
+        """
+        positions = self.positions
+        targets = {positions[pk] for pk in changed if pk in positions}
+        targets.update(
+            positions[pk] for pk in SimilarRecipe.objects.filter(
+                similar_id__in=changed
+            ).values_list('recipe_id', flat=True) if pk in positions
+        )
+        lists = {
+            row['recipe']: (row['count'], row['lowest'])
+            for row in SimilarRecipe.objects.values('recipe').annotate(
+                count=Count('pk'), lowest=Min('score')
+            ).order_by()
+        }
+        changed_rows = sorted(
+            positions[pk] for pk in changed if pk in positions
+        )
+        transposed = self.matrix.T.tocsr()
+        for start in range(0, len(changed_rows), self.chunk_size):
+            scores = (
+                self.matrix[changed_rows[start:start + self.chunk_size]]
+                @ transposed
+            ).tocoo()
+            for column, score in zip(scores.col, scores.data):
+                if column in targets:
+                    continue
+                count, lowest = lists.get(
+                    self.recipe_ids[column], (0, 0)
+                )
+                if count < self.top or score > lowest:
+                    targets.add(int(column))
+        return sorted(targets)
+
+    def neighbours(self, targets):
+        """Тройки (строка, соседняя строка, сходство) для строк targets."""
+        top = min(self.top, len(self.recipe_ids) - 1)
+        if top <= 0:
+            return
+        transposed = self.matrix.T.tocsr()
+        for start in range(0, len(targets), self.chunk_size):
+            block = targets[start:start + self.chunk_size]
+            # Произведение остаётся разреженным: плотный блок занял бы
+            # chunk_size × число рецептов, хотя почти все его ячейки нули.
+            scores = (self.matrix[block] @ transposed).tocsr()
+            for index, row in enumerate(block):
+                begin, end = scores.indptr[index], scores.indptr[index + 1]
+                columns = scores.indices[begin:end]
+                values = scores.data[begin:end]
+                keep = (columns != row) & (values > 0)
+                columns, values = columns[keep], values[keep]
+                if len(values) > top:
+                    best = np.argpartition(-values, top - 1)[:top]
+                    columns, values = columns[best], values[best]
+                for column, score in zip(columns, values):
+                    yield row, int(column), float(score)
@@ -0,0 +1,131 @@
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from api.caching import bump_catalogue_version
+from api.checks import warn_process_local_cache
+from api.images import (VARIANTS_DIR, image_storage, release_variants,
+                        variant_files)
+from recipes.models import ImageBlob, Recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит изображения рецептов в хранилище по хешу содержимого: '
+        'файлы переименовываются в SHA-256, одинаковые сливаются в один, '
+        'рецепты переводятся на новые имена. С --prune удаляет файлы и '
+        'уменьшенные копии, на которые не ссылается ни один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет сделано.')
+        parser.add_argument('--prune', action='store_true',
+                            help='Удалить файлы без ссылок из папок '
+                                 'изображений.')
+
+    def handle(self, *args, **options):
+        self.storage = image_storage()
+        self.dry_run = options['dry_run']
+        self.freed = 0
+        self.targets = set()
+        names = list(
+            Recipes.objects.order_by().values_list(
+                'image', flat=True
+            ).distinct()
+        )
+        renamed = 0
+        for name in names:
+            if not name:
+                continue
+            if not self.storage.exists(name):
+                self.stderr.write(f'Файл не найден: {name}')
+                continue
+            if self.move(name):
+                renamed += 1
+        pruned = 0
+        if options['prune']:
+            pruned = self.prune() + self.prune_variants()
+        if not self.dry_run:
+            call_command('recount', stdout=self.stdout)
+            ImageBlob.objects.filter(references=0).delete()
+            call_command('build_image_variants', stdout=self.stdout)
+            bump_catalogue_version('recipes')
+            warn_process_local_cache(self)
+        self.stdout.write(self.style.SUCCESS(
+            f'Переименовано файлов: {renamed}, удалено без ссылок: {pruned}, '
+            f'освобождено {filesizeformat(self.freed)}.'
+        ))
+
+    def move(self, name):
+        """Переводит рецепты с файла name на файл с именем по хешу."""
+        with self.storage.open(name) as content:
+            target = self.storage.content_name(name, content)
+            if target == name:
+                return False
+            duplicate = (
+                target in self.targets or self.storage.exists(target)
+            )
+            self.targets.add(target)
+            if duplicate:
+                self.freed += self.storage.size(name)
+            self.stdout.write(
+                f'{name} → {target}' + (' (дубль)' if duplicate else '')
+            )
+            if self.dry_run:
+                return True
+            target = self.storage.save(name, content)
+        recipes = Recipes.objects.filter(image=name)
+        previous = list(recipes.values_list('image_variants', flat=True))
+        recipes.update(image=target, image_variants={})
+        self.storage.delete(name)
+        for variants in previous:
+            release_variants(variants)
+        return True
+
+    def prune(self):
+        """Удаляет файлы в папках изображений, не нужные ни одному рецепту."""
+        used = set(Recipes.objects.values_list('image', flat=True))
+        directories = {posixpath.dirname(name) for name in used}
+        directories.add(
+            Recipes._meta.get_field('image').upload_to.rstrip('/')
+        )
+        return sum(
+            self.prune_directory(self.storage, directory, used)
+            for directory in sorted(directories)
+        )
+
+    def prune_variants(self):
+        used = {
+            name
+            for variants in Recipes.objects.values_list(
+                'image_variants', flat=True
+            )
+            for name in variant_files(variants)
+        }
+        if not default_storage.exists(VARIANTS_DIR):
+            return 0
+        return sum(
+            self.prune_directory(
+                default_storage, posixpath.join(VARIANTS_DIR, directory), used
+            )
+            for directory in sorted(default_storage.listdir(VARIANTS_DIR)[0])
+        )
+
+    def prune_directory(self, storage, directory, used):
+        if not storage.exists(directory):
+            return 0
+        pruned = 0
+        for filename in storage.listdir(directory)[1]:
+            name = posixpath.join(directory, filename)
+            if name in used:
+                continue
+            self.freed += storage.size(name)
+            pruned += 1
+            self.stdout.write(f'Без ссылок: {name}')
+            if not self.dry_run:
+                storage.delete(name)
+        return pruned
@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import random
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from api.caching import bump_catalogue_version
+from api.checks import warn_process_local_cache
+from api.search import rebuild_recipe_index
+from api.services import rebuild_shopping_lists, rebuild_timelines
+from recipes.models import (Favorite, Ingredient, RecipeIngredient, Recipes,
+                            ShoppingCart, Tags)
+from users.models import Follow
+
+User = get_user_model()
+
+ALPHABET = 'абвгдежзийклмнопрстуфхцчшщъыьэюя'
+IMAGES_DIR = 'recipes/images'
+IMAGE_COLORS = ('#E26C2D', '#49B64E', '#8775D2', '#F2C94C', '#2D9CDB')
+FAVORITES_PERIOD_DAYS = 30
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def letters(number):
+    """Переводит число в строку из букв: имена проходят валидацию."""
+    result = ''
+    while True:
+        number, index = divmod(number, len(ALPHABET))
+        result = ALPHABET[index] + result
+        if not number:
+            return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Массово создаёт синтетических пользователей, рецепты, подписки, '
+        'избранное и списки покупок для нагрузочного тестирования.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=6,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--favorites', type=int, default=10,
+                            help='Рецептов в избранном на пользователя.')
+        parser.add_argument('--carts', type=int, default=3,
+                            help='Рецептов в списке покупок на пользователя.')
+        parser.add_argument('--min-ingredients', type=int, default=3)
+        parser.add_argument('--max-ingredients', type=int, default=12)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--password', default='foodgram',
+                            help='Пароль всех созданных пользователей.')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            ingredient_ids = self.ingredients()
+            tag_ids = self.tags()
+            user_ids = self.users(options['users'], options['password'])
+            recipe_ids = self.recipes(
+                options['recipes'], user_ids, ingredient_ids, tag_ids,
+                options['min_ingredients'], options['max_ingredients']
+            )
+            self.relations(user_ids, recipe_ids, options)
+            rebuild_recipe_index()
+            rebuild_shopping_lists(user_ids)
+            call_command('recount', stdout=self.stdout)
+            rebuild_timelines()
+        bump_catalogue_version('recipe_ingredients')
+        warn_process_local_cache(self)
+        call_command('build_image_variants', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}.'
+        ))
+
+    def bulk_create(self, model, objects):
+        """Вставляет объекты пачками, не держа их все в памяти."""
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                return
+            model.objects.bulk_create(batch)
+
+    def insert_rows(self, model, fields, rows):
+        """Вставляет кортежи в таблицу связей напрямую, минуя модели."""
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(
+            connection.ops.quote_name(model._meta.get_field(field).column)
+            for field in fields
+        )
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f'INSERT INTO {table} ({columns}) VALUES ({placeholders})'
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    return
+                cursor.executemany(sql, batch)
+
+    def new_ids(self, model, start):
+        return list(
+            model.objects.filter(pk__gt=start).values_list('id', flat=True)
+        )
+
+    def max_id(self, model):
+        return model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+    def ingredients(self):
+        if not Ingredient.objects.exists():
+            with open(os.path.join(settings.BASE_DIR, 'data',
+                                   'ingredients.json'),
+                      encoding='utf-8') as json_file:
+                self.bulk_create(Ingredient, (
+                    Ingredient(**ingredient)
+                    for ingredient in json.load(json_file)
+                ))
+            bump_catalogue_version('ingredients')
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def tags(self):
+        if not Tags.objects.exists():
+            Tags.objects.bulk_create(
+                Tags(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS
+            )
+            bump_catalogue_version('tags')
+        return list(Tags.objects.values_list('id', flat=True))
+
+    def images(self):
+        """Сохраняет несколько маленьких картинок-заглушек в хранилище."""
+        storage = Recipes._meta.get_field('image').storage
+        names = []
+        for color in IMAGE_COLORS:
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), color).save(buffer, 'JPEG')
+            names.append(storage.save(
+                f'{IMAGES_DIR}/placeholder.jpg',
+                ContentFile(buffer.getvalue())
+            ))
+        return names
+
+    def users(self, count, password):
+        start = self.max_id(User)
+        password = make_password(password)
+        self.bulk_create(User, (
+            User(email=f'user{number}@foodgram.ru',
+                 username=f'user{number}',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for number in range(start, start + count)
+        ))
+        return self.new_ids(User, start)
+
+    def recipes(self, count, user_ids, ingredient_ids, tag_ids,
+                min_ingredients, max_ingredients):
+        start = self.max_id(Recipes)
+        images = self.images()
+        self.bulk_create(Recipes, (
+            Recipes(author_id=random.choice(user_ids),
+                    name=f'Рецепт {letters(number)}',
+                    text='Описание рецепта',
+                    image=random.choice(images),
+                    cooking_time=random.randint(1, 120))
+            for number in range(start, start + count)
+        ))
+        recipe_ids = self.new_ids(Recipes, start)
+        max_ingredients = min(max_ingredients, len(ingredient_ids))
+        min_ingredients = min(min_ingredients, max_ingredients)
+        fields = ('recipe', 'ingredient', 'amount')
+        self.insert_rows(RecipeIngredient, fields, (
+            (recipe_id, ingredient_id, random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in random.sample(
+                ingredient_ids,
+                random.randint(min_ingredients, max_ingredients)
+            )
+        ))
+        self.insert_rows(Recipes.tags.through, ('recipes', 'tags'), (
+            (recipe_id, tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in random.sample(tag_ids,
+                                        random.randint(1, len(tag_ids)))
+        ))
+        return recipe_ids
+
+    def relations(self, user_ids, recipe_ids, options):
+        now = timezone.now()
+        moments = [
+            connection.ops.adapt_datetimefield_value(
+                now - timedelta(days=days)
+            )
+            for days in range(FAVORITES_PERIOD_DAYS)
+        ]
+        for model, per_user in ((Favorite, options['favorites']),
+                                (ShoppingCart, options['carts'])):
+            per_user = min(per_user, len(recipe_ids))
+            self.insert_rows(model, ('user', 'recipe', 'created'), (
+                (user_id, recipe_id, random.choice(moments))
+                for user_id in user_ids
+                for recipe_id in random.sample(recipe_ids, per_user)
+            ))
+        follows = min(options['follows'], len(user_ids))
+        self.insert_rows(Follow, ('user', 'author'), (
+            (user_id, author_id)
+            for user_id in user_ids
+            for author_id in random.sample(user_ids, follows)
+            if author_id != user_id
+        ))
@@ -3,6 +3,8 @@ import json
 from django.core.management.base import BaseCommand
 from django.db.utils import IntegrityError
 
+from api.caching import bump_catalogue_version
+from api.checks import warn_process_local_cache
 from recipes.models import Ingredient
 
 
@@ -27,6 +29,8 @@ class Command(BaseCommand):
 
         try:
             Ingredient.objects.bulk_create(ingredients_to_create)
+            bump_catalogue_version('ingredients')
+            warn_process_local_cache(self)
             self.stdout.write(self.style.SUCCESS(
                 'Ингридиенты успешно импортированы.')
             )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.services import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает списки покупок с нуля по содержимому корзин, '
+        'исправляя расхождение после правок в обход API.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='+', dest='users',
+                            help='Пересобрать списки только этих '
+                                 'пользователей.')
+
+    def handle(self, *args, **options):
+        rebuild_shopping_lists(options['users'])
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны.'))
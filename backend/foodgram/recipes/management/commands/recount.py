@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, ImageBlob, Recipes, ShoppingCart
+from users.models import Follow
+
+User = get_user_model()
+
+
+def count_subquery(model, field, outer='pk'):
+    """Количество строк model, ссылающихся на текущую запись через field."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer)}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, списков покупок, рецептов, '
+        'подписчиков, подписок и ссылок на файлы изображений, исправляя '
+        'возможное расхождение.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recipes = Recipes.objects.update(
+                favorites_count=count_subquery(Favorite, 'recipe'),
+                in_carts_count=count_subquery(ShoppingCart, 'recipe'),
+            )
+            users = User.objects.update(
+                recipes_count=count_subquery(Recipes, 'author'),
+                followers_count=count_subquery(Follow, 'author'),
+                following_count=count_subquery(Follow, 'user'),
+            )
+            ImageBlob.objects.bulk_create((
+                ImageBlob(name=name) for name in Recipes.objects.order_by(
+                ).values_list('image', flat=True).distinct()
+            ), ignore_conflicts=True)
+            ImageBlob.objects.update(
+                references=count_subquery(Recipes, 'image', 'name')
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны: рецептов {recipes}, '
+            f'пользователей {users}.'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.services import refresh_leaderboard
+from recipes.models import RecipeRanking
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинги популярных и набирающих популярность '
+        'рецептов. Удобно запускать по расписанию, чтобы запросы не '
+        'ждали пересчёта после истечения LEADERBOARD_TTL.'
+    )
+
+    def handle(self, *args, **options):
+        for board, title in RecipeRanking.BOARDS:
+            refresh_leaderboard(board, force=True)
+            self.stdout.write(f'{title}: рейтинг пересчитан.')
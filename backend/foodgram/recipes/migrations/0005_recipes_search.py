@@ -0,0 +1,52 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:10
+
+from django.db import migrations
+
+POSTGRES_FORWARD = (
+    "ALTER TABLE recipes_recipes ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+    ") STORED",
+    "CREATE INDEX recipes_search_vector_idx ON recipes_recipes "
+    "USING gin (search_vector)",
+)
+POSTGRES_BACKWARD = (
+    'DROP INDEX IF EXISTS recipes_search_vector_idx',
+    'ALTER TABLE recipes_recipes DROP COLUMN IF EXISTS search_vector',
+)
+SQLITE_FORWARD = (
+    'CREATE VIRTUAL TABLE recipes_search USING fts5(name, text)',
+    'INSERT INTO recipes_search(rowid, name, text) '
+    'SELECT id, name, text FROM recipes_recipes',
+)
+SQLITE_BACKWARD = (
+    'DROP TABLE IF EXISTS recipes_search',
+)
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+    """Полнотекстовый индекс рецептов.
+
+    В Postgres это вычисляемая колонка tsvector с GIN-индексом, в SQLite —
+    отдельная таблица FTS5, которую синхронизирует api.search. Для других
+    СУБД индекс не создаётся, поиск работает через icontains.
+    """
+
+    dependencies = [
+        ('recipes', '0004_recipes_pub_date_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:50
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Покрывающий индекс связи рецептов и тегов в обратном порядке.
+
+    Уникальный индекс (recipes_id, tags_id) Django создаёт сам, а для
+    выборки рецептов по тегу нужен (tags_id, recipes_id). Таблица связи
+    создаётся автоматически, поэтому индекс задан на SQL.
+    """
+
+    dependencies = [
+        ('recipes', '0006_recipes_similarity'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX recipes_tags_tag_recipe_idx '
+            'ON recipes_recipes_tags (tags_id, recipes_id)',
+            'DROP INDEX recipes_tags_tag_recipe_idx',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.19 on 2026-10-18 21:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipes_tags_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipeRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('popular', 'Популярные'), ('trending', 'Набирают популярность')], help_text='Рейтинг', max_length=16, verbose_name='Рейтинг')),
+                ('position', models.PositiveIntegerField(help_text='Место в рейтинге, начиная с 1', verbose_name='Место')),
+                ('score', models.PositiveIntegerField(help_text='Добавлений в избранное и списки покупок', verbose_name='Добавлений')),
+                ('recipe', models.ForeignKey(help_text='Рецепт', on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='recipes.recipes', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Место в рейтинге',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['board', 'position'], name='recipe_ranking_position_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reciperanking',
+            constraint=models.UniqueConstraint(fields=('board', 'recipe'), name='unique_recipe_ranking'),
+        ),
+    ]
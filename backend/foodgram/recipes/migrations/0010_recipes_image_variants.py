@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipes_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, help_text='Размеры и файлы копий, построенных api.images', verbose_name='Уменьшенные копии изображения'),
+        ),
+    ]
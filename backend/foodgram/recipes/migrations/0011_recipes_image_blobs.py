@@ -0,0 +1,45 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+import recipes.storage
+
+
+def count_blobs(apps, schema_editor):
+    Recipes = apps.get_model('recipes', 'Recipes')
+    ImageBlob = apps.get_model('recipes', 'ImageBlob')
+    ImageBlob.objects.bulk_create(
+        ImageBlob(name=name, references=total)
+        for name, total in Recipes.objects.order_by().values(
+            'image'
+        ).annotate(total=Count('pk')).values_list('image', 'total')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipes_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('references', models.PositiveIntegerField(default=0, editable=False, help_text='Сколько рецептов используют файл', verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipes',
+            name='image',
+            field=models.ImageField(db_index=True, help_text='Добавьте файл с изображением', storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/image/', verbose_name='Изображение блюда'),
+        ),
+        migrations.RunPython(count_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Sum
+
+CHUNK_SIZE = 2000
+
+
+def fill_shopping_lists(apps, schema_editor):
+    # Повторяет api.services.rebuild_shopping_lists на исторических моделях:
+    # 0002 создала таблицу, но не заполнила её по уже лежащим корзинам.
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    ShoppingList.objects.all().delete()
+    ingredient = 'recipe__ingredients_amount__ingredient_id'
+    totals = ShoppingCart.objects.filter(
+        **{f'{ingredient}__isnull': False}
+    ).values('user_id', ingredient).annotate(
+        amount=Sum('recipe__ingredients_amount__amount')
+    ).order_by().iterator(chunk_size=CHUNK_SIZE)
+    batch = []
+    for total in totals:
+        batch.append(ShoppingList(
+            user_id=total['user_id'],
+            ingredient_id=total[ingredient],
+            amount=total['amount']
+        ))
+        if len(batch) == CHUNK_SIZE:
+            ShoppingList.objects.bulk_create(batch)
+            batch = []
+    ShoppingList.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipes_image_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+import datetime
+
+from django.db import migrations
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils.timezone import utc
+
+UNKNOWN_CREATED = datetime.datetime(2000, 1, 1, tzinfo=utc)
+
+
+def backfill_created(apps, schema_editor):
+    # Строки, которые уже были, когда 0008 добавила поле, получили время
+    # самой миграции и попадали в рейтинг «набирают популярность».
+    # Настоящее время добавления неизвестно, поэтому ставится давнее.
+    applied = MigrationRecorder(schema_editor.connection).migration_qs.filter(
+        app='recipes', name='0008_recipes_rankings'
+    ).values_list('applied', flat=True).first()
+    if applied is None:
+        return
+    for name in ('Favorite', 'ShoppingCart'):
+        apps.get_model('recipes', name).objects.filter(
+            created__lte=applied
+        ).update(created=UNKNOWN_CREATED)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_fill_shopping_lists'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+    ]
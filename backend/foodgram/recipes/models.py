@@ -3,7 +3,9 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, validate_slug
 from django.db import models
 
+from recipes.storage import ContentAddressedStorage
 from recipes.validators import ColorValidator
+from users.models import UpdatedByQueriesMixin
 from users.validators import UserNameValidator
 
 User = get_user_model()
@@ -69,7 +71,7 @@ class Tags(models.Model):
         return self.slug
 
 
-class Recipes(models.Model):
+class Recipes(UpdatedByQueriesMixin, models.Model):
     """Модель рецепта."""
     author = models.ForeignKey(
         User,
@@ -88,8 +90,16 @@ class Recipes(models.Model):
     image = models.ImageField(
         verbose_name='Изображение блюда',
         upload_to='recipes/image/',
+        storage=ContentAddressedStorage(),
+        db_index=True,
         help_text='Добавьте файл с изображением'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        help_text='Размеры и файлы копий, построенных api.images',
+        default=dict,
+        editable=False,
+    )
     text = models.TextField(verbose_name='Описание рецепта')
     tags = models.ManyToManyField(Tags, verbose_name='Теги')
     pub_date = models.DateTimeField(auto_now_add=True)
@@ -105,11 +115,202 @@ class Recipes(models.Model):
         ],
         default=1,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        help_text='Сколько раз рецепт добавлен в избранное',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        help_text='Сколько раз рецепт добавлен в список покупок',
+        default=0,
+        editable=False,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    similar_built = models.DateTimeField(
+        verbose_name='Похожие рецепты рассчитаны',
+        help_text='Когда build_similarity последний раз считал рецепт',
+        null=True,
+        editable=False,
+    )
+
+    updated_by_queries = (
+        'favorites_count', 'in_carts_count', 'image_variants',
+        'similar_built',
+    )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipes_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipes_author_pub_date_idx',
+            ),
+        )
+
+
+class ImageBlob(models.Model):
+    """Модель файла изображения в хранилище по хешу содержимого.
+
+    Один файл может стоять у нескольких рецептов; он удаляется, только
+    когда ссылок на него не остаётся.
+    """
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Файл',
+    )
+    references = models.PositiveIntegerField(
+        verbose_name='Ссылок',
+        help_text='Сколько рецептов используют файл',
+        default=0,
+        editable=False,
+    )
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return self.name
+
+
+class SimilarRecipe(models.Model):
+    """Модель заранее рассчитанного похожего рецепта."""
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+        help_text='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='similar_for',
+        verbose_name='Похожий рецепт',
+        help_text='Похожий рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+        help_text='Косинусное сходство ингредиентов и тегов',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx',
+            ),
+        )
+
+
+class RecipeRanking(models.Model):
+    """Модель места рецепта в заранее рассчитанном рейтинге."""
+    POPULAR = 'popular'
+    TRENDING = 'trending'
+    BOARDS = (
+        (POPULAR, 'Популярные'),
+        (TRENDING, 'Набирают популярность'),
+    )
+    board = models.CharField(
+        max_length=16,
+        choices=BOARDS,
+        verbose_name='Рейтинг',
+        help_text='Рейтинг',
+    )
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='rankings',
+        verbose_name='Рецепт',
+        help_text='Рецепт',
+    )
+    position = models.PositiveIntegerField(
+        verbose_name='Место',
+        help_text='Место в рейтинге, начиная с 1',
+    )
+    score = models.PositiveIntegerField(
+        verbose_name='Добавлений',
+        help_text='Добавлений в избранное и списки покупок',
+    )
+
+    class Meta:
+        verbose_name = 'Место в рейтинге'
+        verbose_name_plural = 'Рейтинги рецептов'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('board', 'recipe'),
+                name='unique_recipe_ranking',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('board', 'position'),
+                name='recipe_ranking_position_idx',
+            ),
+        )
+
+
+class FeedEntry(models.Model):
+    """Модель записи в заранее собранной ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Читатель ленты',
+        help_text='Читатель ленты',
+    )
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+        help_text='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+        help_text='Автор рецепта',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации рецепта')
+
+    class Meta:
+        ordering = ('-pub_date', '-recipe_id')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_entry_user_pub_date_idx',
+            ),
+        )
 
 
 class RecipeIngredient(models.Model):
@@ -165,6 +366,11 @@ class Favorite(models.Model):
         verbose_name='Избранный рецепт',
         help_text='Избранный рецепт',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -188,6 +394,11 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт в списке покупок',
         help_text='Рецепт в списке покупок',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -198,3 +409,38 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart',
             ),
         )
+
+
+class ShoppingList(models.Model):
+    """Модель суммарного количества ингредиента в списке покупок."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+        help_text='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+        help_text='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        help_text='Суммарное количество ингредиента в списке покупок',
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_ingredient',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} – {self.amount}'
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла — SHA-256 его содержимого.
+
+    Папка и расширение берутся из предложенного имени. Одинаковые файлы
+    получают одно имя и хранятся один раз: если такой файл уже есть,
+    запись пропускается. Содержимое под именем не меняется, поэтому
+    такие файлы можно отдавать с бессрочным кешированием.
+
+    Перед проверкой наличия файла блокируется его строка ImageBlob, и
+    блокировка держится до конца транзакции сохранения. Иначе уборка
+    файлов без ссылок могла бы удалить имеющийся файл раньше, чем на
+    него появится ссылка.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest.hexdigest() + extension
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super().save(
+            self.content_name(name, content), content, max_length
+        )
+
+    def get_available_name(self, name, max_length=None):
+        # Файл с тем же именем — тот же самый файл, переименовывать нечего.
+        return name
+
+    def _save(self, name, content):
+        with transaction.atomic(savepoint=False):
+            blobs = apps.get_model('recipes', 'ImageBlob').objects
+            blobs.select_for_update().get_or_create(name=name)
+            return self._write(name, content)
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Файл пишется рядом и переносится одной операцией: параллельная
+        # запись того же содержимого не оставит его недописанным.
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as temp:
+            try:
+                for chunk in content.chunks():
+                    temp.write(chunk)
+            except BaseException:
+                os.unlink(temp.name)
+                raise
+        # Временный файл создаётся с правами 0600, nginx его не прочтёт.
+        os.chmod(temp.name, self.file_permissions_mode or 0o644)
+        os.replace(temp.name, full_path)
+        return name
@@ -7,6 +7,9 @@ User = get_user_model()
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_filter = ('username', 'email',)
+    readonly_fields = (
+        'recipes_count', 'followers_count', 'following_count',
+    )
 
 
 admin.site.unregister(models.Group)
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 21:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    User.objects.update(following_count=Coalesce(Subquery(
+        Follow.objects.filter(user=OuterRef('pk')).order_by().values(
+            'user'
+        ).annotate(total=Count('pk')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='На скольких авторов подписан пользователь', verbose_name='Подписок'),
+        ),
+        migrations.RunPython(recount, migrations.RunPython.noop),
+    ]
@@ -9,7 +9,32 @@ from users.validators import UserNameValidator, check_username
 regex_validator = UserNameValidator()
 
 
-class User(AbstractUser):
+class UpdatedByQueriesMixin:
+    """Не даёт полному save() затереть поля, которые пишутся запросами.
+
+    Счётчики меняются выражениями F() в UPDATE, и копия модели, прочитанная
+    раньше, перезаписала бы параллельные изменения. Поэтому save() без
+    update_fields сохраняет все поля, кроме перечисленных в
+    updated_by_queries.
+    """
+    updated_by_queries = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if update_fields is None and not (
+            force_insert or self._state.adding
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.updated_by_queries
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class User(UpdatedByQueriesMixin, AbstractUser):
     """Пользовательская модель пользователя."""
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -37,6 +62,28 @@ class User(AbstractUser):
                     UnicodeUsernameValidator()
                     ]
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        help_text='Количество рецептов пользователя',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        help_text='Количество подписчиков пользователя',
+        default=0,
+        editable=False,
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок',
+        help_text='На скольких авторов подписан пользователь',
+        default=0,
+        editable=False,
+    )
+
+    updated_by_queries = (
+        'recipes_count', 'followers_count', 'following_count',
+    )
 
     class Meta:
         verbose_name = 'Пользователь'